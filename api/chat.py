@@ -1,42 +1,154 @@
 """聊天API路由"""
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Body
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
-import json
+from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi.responses import ORJSONResponse
+from sse_starlette.sse import EventSourceResponse
+from sqlalchemy import and_, delete, exists, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple
+import asyncio
 import time
+from contextlib import aclosing, suppress
+import orjson
 import logging
 import uuid
-from models.enums import SearchStrategy
-from core.database import get_db
+from core.database import AsyncSessionLocal, get_async_db
 from core.config import settings
 from models.schemas import (
-    ChatRequest, ChatResponse, ChatSessionCreate, ChatSessionResponse,
-    ChatSessionDelete, ChatSessionUpdateTitle, ChatMessage, BaseResponse,
+    ChatRequest, ChatSessionCreate, ChatSessionResponse,
+    ChatSessionDelete, ChatSessionUpdateTitle, BaseResponse,
     ChatMessageDelete
 )
 from models.database import ChatSession, ChatMessage as DBChatMessage, User
-from services.chat_service import ChatService
-from services.search_service import SearchService
+from services.chat_service import (
+    ChatService, truncate_title, register_stream, unregister_stream, stop_stream_generation
+)
+from utils.time_utils import format_datetime
+from utils.cache_utils import cache_get_json_async, cache_set_json_async, cache_delete_async
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-from core import active_streams
+# 默认用户ID（配置读取后缓存，避免每次请求解析配置）
+DEFAULT_USER_ID = settings.default_user_id
+
+# 热点查询缓存过期时间（秒）
+USER_EXISTS_CACHE_TTL = 300
+SESSION_CACHE_TTL = 60
+# SSE心跳间隔（秒），避免nginx等代理关闭空闲连接
+SSE_PING_INTERVAL = 15
+# content帧合并发送：缓冲片段数或距上次发送的时间（秒）达到阈值时发送一帧
+SSE_CONTENT_BATCH_SIZE = 8
+SSE_CONTENT_FLUSH_INTERVAL = 0.015
+
+def get_chat_service(db: AsyncSession = Depends(get_async_db)) -> ChatService:
+    """聊天服务依赖：绑定当前请求的数据库会话，大模型客户端等重资源在进程内共享"""
+    return ChatService(db=db)
+
+async def _user_exists(db: AsyncSession, user_id: str) -> bool:
+    """检查用户是否存在（优先读取Redis缓存，仅缓存存在的结果）"""
+    cache_key = f"user:exists:{user_id}"
+    if await cache_get_json_async(cache_key):
+        return True
+    found = await db.scalar(select(User.id).where(User.id == user_id).limit(1)) is not None
+    if found:
+        await cache_set_json_async(cache_key, True, USER_EXISTS_CACHE_TTL)
+    return found
+
+async def _get_cached_session(db: AsyncSession, session_id: str) -> Optional[dict]:
+    """获取会话基本信息（优先读取Redis缓存），会话不存在返回None"""
+    cache_key = f"session:{session_id}"
+    session_info = await cache_get_json_async(cache_key)
+    if session_info is not None:
+        return session_info
+    session = (await db.execute(
+        select(ChatSession.id, ChatSession.user_id, ChatSession.is_active).where(ChatSession.id == session_id)
+    )).first()
+    if not session:
+        return None
+    session_info = {"id": session.id, "user_id": session.user_id, "is_active": session.is_active}
+    await cache_set_json_async(cache_key, session_info, SESSION_CACHE_TTL)
+    return session_info
+
+def _parse_session_cursor(cursor: str) -> tuple:
+    """解析会话列表游标（格式: "更新时间|会话ID"）"""
+    try:
+        updated_at, session_id = cursor.split("|", 1)
+        return datetime.strptime(updated_at, '%Y-%m-%d %H:%M:%S'), session_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+async def _invalidate_session_cache(session_id: str):
+    """会话变更后清除缓存"""
+    await cache_delete_async(f"session:{session_id}")
+
+def _sse(payload: dict) -> bytes:
+    """将事件数据编码为SSE帧（orjson直接输出UTF-8字节，不转义非ASCII字符）
+    
+    EventSourceResponse对bytes帧原样透传，无需再经过字符串格式化。
+    """
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
 
-# 服务实例
-search_service = SearchService()
+async def _merge_content_chunks(stream: AsyncIterator[Tuple[str, str]]) -> AsyncIterator[Tuple[str, str]]:
+    """合并连续的content片段，减少逐token写出的帧数；think及控制帧不缓冲
+    
+    缓冲片段数或距上次发送的时间达到阈值时发送一帧。等待下一个片段时以剩余时间为超时，
+    模型停顿（首token较慢、调用工具、回答收尾）时已缓冲的内容也按时发出，不会滞留到下一个片段到达。
+    下一个片段在独立任务中读取，超时只停止等待，不会取消进行中的读取而中断上游生成器。
+    """
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    content_buf = []
+    last_flush = loop.time()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(last_flush + SSE_CONTENT_FLUSH_INTERVAL - loop.time(), 0) if content_buf else None
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if not done:
+                yield 'content', ''.join(content_buf)
+                content_buf.clear()
+                last_flush = loop.time()
+                continue
+            next_item, pending = pending, None
+            try:
+                _type, chunk = next_item.result()
+            except StopAsyncIteration:
+                break
+            if _type == 'content':
+                content_buf.append(chunk)
+                if len(content_buf) >= SSE_CONTENT_BATCH_SIZE or loop.time() - last_flush > SSE_CONTENT_FLUSH_INTERVAL:
+                    yield 'content', ''.join(content_buf)
+                    content_buf.clear()
+                    last_flush = loop.time()
+            else:
+                if content_buf:
+                    yield 'content', ''.join(content_buf)
+                    content_buf.clear()
+                    last_flush = loop.time()
+                yield _type, chunk
+        if content_buf:
+            yield 'content', ''.join(content_buf)
+    finally:
+        # 提前结束（取消或客户端断开）时停止进行中的读取并关闭上游生成器
+        if pending is not None:
+            pending.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await pending
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
 
 @router.post("/create_session", response_model=BaseResponse)
 async def create_chat_session(
     session_data: ChatSessionCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建聊天会话"""
     try:
         # 检查用户是否存在
-        user = db.query(User).filter(User.id == session_data.user_id).first()
-        if not user:
+        if not await _user_exists(db, session_data.user_id):
             raise HTTPException(status_code=404, detail="用户不存在")
         
         # 创建会话
@@ -45,14 +157,18 @@ async def create_chat_session(
             title=session_data.title
         )
         db.add(session)
-        db.commit()
-        db.refresh(session)
+        # flush后主键与默认值已在本地对象上，提交前构建响应，避免commit后属性过期触发refresh查询
+        await db.flush()
+        session_data = ChatSessionResponse.model_validate(session)
+        await db.commit()
         
         return BaseResponse(
             success=True,
             message="会话创建成功",
-            data=ChatSessionResponse.from_orm(session)
+            data=session_data
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"创建会话失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -62,30 +178,67 @@ async def get_chat_sessions(
     user_id: str = settings.default_user_id,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取用户的聊天会话列表"""
+    """获取用户的聊天会话列表
+    
+    传入上一页返回的next_cursor时使用游标分页（按更新时间与ID定位），不再扫描并丢弃前skip行。
+    """
     try:
-        sessions = db.query(ChatSession).filter(
+        # 按会话聚合消息数量，与会话列表一次查询返回，避免逐个会话COUNT
+        counts = select(
+            DBChatMessage.session_id,
+            func.count(DBChatMessage.id).label('message_count')
+        ).group_by(DBChatMessage.session_id).subquery()
+        
+        stmt = select(
+            ChatSession.id,
+            ChatSession.title,
+            ChatSession.created_at,
+            ChatSession.updated_at,
+            ChatSession.is_active,
+            func.coalesce(counts.c.message_count, 0).label('message_count')
+        ).outerjoin(
+            counts, counts.c.session_id == ChatSession.id
+        ).where(
             ChatSession.user_id == user_id,
             ChatSession.is_active == True
-        ).order_by(ChatSession.updated_at.desc()).offset(skip).limit(limit).all()
+        ).order_by(ChatSession.updated_at.desc(), ChatSession.id.desc()).limit(limit)
+        if cursor:
+            cursor_updated_at, cursor_id = _parse_session_cursor(cursor)
+            stmt = stmt.where(or_(
+                ChatSession.updated_at < cursor_updated_at,
+                and_(ChatSession.updated_at == cursor_updated_at, ChatSession.id < cursor_id)
+            ))
+        else:
+            stmt = stmt.offset(skip)
+        rows = (await db.execute(stmt)).mappings().all()
         
-        session_responses = []
-        for session in sessions:
-            message_count = db.query(DBChatMessage).filter(
-                DBChatMessage.session_id == session.id
-            ).count()
-            
-            session_data = ChatSessionResponse.from_orm(session)
-            session_data.message_count = message_count
-            session_responses.append(session_data)
+        session_responses = [
+            {
+                "id": row["id"],
+                "title": row["title"],
+                "created_at": format_datetime(row["created_at"]),
+                "updated_at": format_datetime(row["updated_at"]),
+                "is_active": row["is_active"],
+                "message_count": row["message_count"]
+            }
+            for row in rows
+        ]
         
-        return BaseResponse(
-            success=True,
-            message="获取会话列表成功",
-            data=session_responses
-        )
+        next_cursor = None
+        if len(rows) == limit and rows[-1]["updated_at"]:
+            next_cursor = f"{session_responses[-1]['updated_at']}|{rows[-1]['id']}"
+        
+        return ORJSONResponse({
+            "success": True,
+            "message": "获取会话列表成功",
+            "data": session_responses,
+            "next_cursor": next_cursor
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取会话列表失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -93,54 +246,58 @@ async def get_chat_sessions(
 @router.post("/sessions/delete", response_model=BaseResponse)
 async def delete_chat_session(
     request: ChatSessionDelete,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除聊天会话（物理删除）"""
     try:
-        # 检查会话是否存在
-        session = db.query(ChatSession).filter(ChatSession.id == request.session_id).first()
-        if not session:
-            raise HTTPException(status_code=404, detail="会话不存在")
-        
-        # 物理删除：先删除会话相关的消息
-        db.query(DBChatMessage).filter(DBChatMessage.session_id == request.session_id).delete()
+        # 物理删除：先删除会话相关的消息（无需同步会话内对象状态）
+        await db.execute(
+            delete(DBChatMessage).where(DBChatMessage.session_id == request.session_id)
+        )
         
-        # 再删除会话本身
-        db.delete(session)
-        db.commit()
+        # 再删除会话本身，通过影响行数判断会话是否存在
+        result = await db.execute(delete(ChatSession).where(ChatSession.id == request.session_id))
+        if result.rowcount == 0:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="会话不存在")
+        await db.commit()
+        await _invalidate_session_cache(request.session_id)
         
         return BaseResponse(
             success=True,
             message="会话删除成功",
             data={"session_id": request.session_id}
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"删除会话失败: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/sessions/update_title", response_model=BaseResponse)
 async def update_session_title(
     request: ChatSessionUpdateTitle,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """修改会话标题"""
     try:
-        # 查找会话
-        session = db.query(ChatSession).filter(ChatSession.id == request.session_id).first()
-        if not session:
+        # 直接更新标题，通过影响行数判断会话是否存在
+        result = await db.execute(
+            update(ChatSession).where(ChatSession.id == request.session_id).values(title=request.title)
+        )
+        if result.rowcount == 0:
+            await db.rollback()
             raise HTTPException(status_code=404, detail="会话不存在")
-        
-        # 更新标题
-        session.title = request.title
-        db.commit()
+        await db.commit()
+        await _invalidate_session_cache(request.session_id)
         
         return BaseResponse(
             success=True,
             message="会话标题修改成功",
             data={
-                "session_id": session.id,
-                "title": session.title
+                "session_id": request.session_id,
+                "title": request.title
             }
         )
         
@@ -148,23 +305,22 @@ async def update_session_title(
         raise
     except Exception as e:
         logger.error(f"修改会话标题失败: {e}")
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/messages/delete", response_model=BaseResponse)
 async def delete_chat_message(
     request: ChatMessageDelete,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除聊天消息（物理删除）"""
     try:
-        # 检查消息是否存在
-        message = db.query(DBChatMessage).filter(DBChatMessage.id == request.message_id).first()
-        if not message:
+        # 物理删除消息，通过影响行数判断消息是否存在
+        result = await db.execute(delete(DBChatMessage).where(DBChatMessage.id == request.message_id))
+        if result.rowcount == 0:
+            await db.rollback()
             raise HTTPException(status_code=404, detail="消息不存在")
-        
-        # 物理删除消息
-        db.delete(message)
-        db.commit()
+        await db.commit()
         
         return BaseResponse(
             success=True,
@@ -175,7 +331,7 @@ async def delete_chat_message(
         raise
     except Exception as e:
         logger.error(f"删除消息失败: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sessions/{session_id}/messages", response_model=BaseResponse)
@@ -183,102 +339,205 @@ async def get_chat_messages(
     session_id: str,
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db)
+    after_seq: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取会话的聊天消息"""
+    """获取会话的聊天消息
+    
+    传入after_seq（上一页返回的next_cursor）时按消息序号游标分页，走(session_id, sequence_number)索引。
+    """
     try:
-        # 检查会话是否存在
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-        if not session:
+        # 检查会话是否存在（EXISTS查询，不加载整行）
+        if not await db.scalar(select(exists().where(ChatSession.id == session_id))):
             raise HTTPException(status_code=404, detail="会话不存在")
         
-        # 优化查询：添加索引提示并限制返回字段
-        messages = db.query(DBChatMessage).filter(
+        # 使用Core查询仅取所需列，避免ORM对象构建与Pydantic二次校验
+        stmt = select(
+            DBChatMessage.id,
+            DBChatMessage.role,
+            DBChatMessage.content,
+            DBChatMessage.sequence_number,
+            DBChatMessage.created_at,
+            DBChatMessage.knowledge_sources,
+            DBChatMessage.web_search_results,
+            DBChatMessage.thinking_process
+        ).where(
             DBChatMessage.session_id == session_id
-        ).order_by(DBChatMessage.sequence_number.asc()).offset(skip).limit(limit).all()
+        ).order_by(DBChatMessage.sequence_number.asc()).limit(limit)
+        if after_seq is not None:
+            stmt = stmt.where(DBChatMessage.sequence_number > after_seq)
+        else:
+            stmt = stmt.offset(skip)
+        rows = (await db.execute(stmt)).mappings().all()
         
-        # 手动构建响应对象，避免ORM的额外开销
-        message_responses = []
-        for msg in messages:
-            message_responses.append(ChatMessage(
-                id=msg.id,
-                role=msg.role,
-                content=msg.content,
-                sequence_number=msg.sequence_number,
-                created_at=msg.created_at,
-                sources={
-                    'knowledge_sources': json.loads(msg.knowledge_sources) if msg.knowledge_sources else [],
-                    'web_search_results': json.loads(msg.web_search_results) if msg.web_search_results else []
-                } if (msg.knowledge_sources or msg.web_search_results) else None,
-                thinking_process=msg.thinking_process
-            ))
+        message_responses = [
+            {
+                "id": row["id"],
+                "role": row["role"],
+                "content": row["content"],
+                "sequence_number": row["sequence_number"],
+                "created_at": format_datetime(row["created_at"]),
+                # 来源字段入库时已是JSON文本，以Fragment原样嵌入响应，避免反序列化后再序列化
+                "sources": {
+                    'knowledge_sources': orjson.Fragment(row["knowledge_sources"] or "[]"),
+                    'web_search_results': orjson.Fragment(row["web_search_results"] or "[]")
+                } if (row["knowledge_sources"] or row["web_search_results"]) else None,
+                "thinking_process": row["thinking_process"]
+            }
+            for row in rows
+        ]
         
-        return BaseResponse(
-            success=True,
-            message="获取消息列表成功",
-            data=message_responses
-        )
+        return ORJSONResponse({
+            "success": True,
+            "message": "获取消息列表成功",
+            "data": message_responses,
+            "next_cursor": rows[-1]["sequence_number"] if len(rows) == limit else None
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取消息列表失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _persist_conversation(
+    request: ChatRequest,
+    request_id: str,
+    session_id: str,
+    full_response: str,
+    thinking_process: str,
+    knowledge_json: Optional[bytes],
+    web_json: Optional[bytes],
+    was_cancelled: bool
+) -> Optional[str]:
+    """保存流式对话结果（在后台任务中执行）
+    
+    使用独立的数据库会话，客户端断开后请求会话被关闭也不影响保存。
+    
+    Returns:
+        Optional[str]: 新会话生成并保存成功的标题，无需推送时返回None
+    """
+    async with AsyncSessionLocal() as db:
+        return await _save_stream_result(
+            ChatService(db=db), request, request_id, session_id, full_response,
+            thinking_process, knowledge_json, web_json, was_cancelled
+        )
+
+async def _save_stream_result(
+    chat_service: ChatService,
+    request: ChatRequest,
+    request_id: str,
+    session_id: str,
+    full_response: str,
+    thinking_process: str,
+    knowledge_json: Optional[bytes],
+    web_json: Optional[bytes],
+    was_cancelled: bool
+) -> Optional[str]:
+    """保存流式对话结果，新会话同时生成标题"""
+    if was_cancelled:
+        # 如果被取消，使用ChatService的中断处理方法
+        await chat_service.handle_stream_interruption(
+            request_id=request_id,
+            session_id=session_id,
+            user_message=request.message,
+            partial_response=full_response
+        )
+        return None
+    if not full_response.strip():
+        return None
+    try:
+        # 如果是新会话，先生成标题，与对话记录在同一事务中提交
+        session_title = None
+        if request.is_first:
+            try:
+                session_title = await chat_service.generate_session_title_from_input(request.message)
+            except Exception as e:
+                logger.error(f"异步生成标题失败: {e}")
+                # 如果生成失败，使用用户消息的前几个字符作为标题
+                session_title = truncate_title(request.message, 10)
+        
+        saved = await chat_service.save_conversation_history(
+            session_id=session_id,
+            user_message=request.message,
+            assistant_message=full_response,
+            knowledge_sources=knowledge_json,
+            web_search_results=web_json,
+            thinking_process=thinking_process if thinking_process.strip() else None,
+            session_title=session_title
+        )
+        logger.info(f"💾 已保存完整的对话记录，内容长度: {len(full_response)}, 思考过程长度: {len(thinking_process)}")
+        return session_title if saved else None
+    except Exception as e:
+        logger.error(f"保存对话历史失败: {e}")
+        return None
+
 @router.post("/stream")
 async def chat_stream(
     request: ChatRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    chat_service: ChatService = Depends(get_chat_service)
 ):
     """流式聊天接口"""
     request_id = uuid.uuid4().hex
-    active_streams[request_id] = {"cancelled": False}
+    cancel_event = await register_stream(request_id)
 
     async def generate():
         try:
             # 发送请求ID
-            yield f"data: {json.dumps({'type': 'request_id', 'request_id': request_id}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'request_id', 'request_id': request_id})
             # 发送start事件，让前端创建消息元素
-            yield f"data: {json.dumps({'type': 'start'}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'start'})
             start_time = time.time()
-            # 初始化ChatService
-            chat_service = ChatService(db=db)
             # 检查session_id是否提供
             if not request.session_id:
-                yield f"data: {json.dumps({'error': '请先创建会话'}, ensure_ascii=False)}\n\n"
+                yield _sse({'error': '请先创建会话'})
                 return
             # 处理新会话创建
             if request.is_first:
-                user_id = request.user_id or settings.default_user_id
+                user_id = request.user_id or DEFAULT_USER_ID
                 new_session = ChatSession(
                     id=request.session_id,  # 使用前端传入的UUID
                     user_id=user_id,
                     title="新会话"  # 使用临时标题
                 )
                 db.add(new_session)
-                db.commit()
-                db.refresh(new_session)
-                session_id = new_session.id
-                session = new_session
+                await db.commit()
+                # 会话ID由前端提供，无需refresh回查
+                session_id = request.session_id
                 # 发送会话信息给前端（使用临时标题）
-                yield f"data: {json.dumps({'type': 'session_info', 'session_id': session_id, 'session_name': '新会话'}, ensure_ascii=False)}\n\n"
+                yield _sse({'type': 'session_info', 'session_id': session_id, 'session_name': '新会话'})
             else:
                 session_id = request.session_id
-                session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-                if not session:
-                    yield f"data: {json.dumps({'error': '会话不存在'}, ensure_ascii=False)}\n\n"
+                if not await _get_cached_session(db, session_id):
+                    yield _sse({'error': '会话不存在'})
                     return
             # 使用intelligent_chat进行流式生成
             full_response = ""
             thinking_process = ""
             was_cancelled = False
+            search_result = {'knowledge_results': [], 'web_results': []}
+            knowledge_json = None
+            web_json = None
             try:
                 search_result = await chat_service.intelligent_search(
                     query=request.message,
-                    strategy=SearchStrategy(request.search_strategy),
+                    strategy=request.search_strategy,
                     kg_max_results=request.search_top_k,
                     similarity_threshold=request.similarity_threshold,
                     group_id=request.group_id
                 )
-                yield f"data: {json.dumps({'type': 'source', 'content': search_result}, ensure_ascii=False)}\n\n"
-                async for _type, chunk in chat_service.generate_stream_response(
+                # 检索结果只序列化一次，SSE推送与入库复用同一份JSON
+                if search_result['knowledge_results']:
+                    knowledge_json = orjson.dumps(search_result['knowledge_results'])
+                if search_result['web_results']:
+                    web_json = orjson.dumps(search_result['web_results'])
+                yield _sse({'type': 'source', 'content': {
+                    **search_result,
+                    'knowledge_results': orjson.Fragment(knowledge_json or b"[]"),
+                    'web_results': orjson.Fragment(web_json or b"[]")
+                }})
+                # 合并连续的content片段后逐帧推送
+                async with aclosing(_merge_content_chunks(chat_service.generate_stream_response(
                     message=request.message,
                     knowledge_sources=search_result['knowledge_results'],
                     web_search_results=search_result['web_results'],
@@ -286,114 +545,71 @@ async def chat_stream(
                     session_id=session_id,
                     max_tokens=request.max_tokens,
                     temperature=request.temperature
-                ):
-                    if _type == 'content':
-                        full_response += chunk
-                    elif _type == 'think':
-                        thinking_process += chunk
-                    
-                    yield f"data: {json.dumps({'type': _type, 'content': chunk}, ensure_ascii=False)}\n\n"
-                    # 检查是否被取消
-                    if request_id in active_streams and active_streams[request_id].get('cancelled', False):
-                        was_cancelled = True
-                        logger.info(f"🛑 检测到流式响应被取消，已生成内容长度: {len(full_response)}")
-                        break
+                ))) as chunks:
+                    async for _type, chunk in chunks:
+                        if _type == 'content':
+                            full_response += chunk
+                        elif _type == 'think':
+                            thinking_process += chunk
+                        yield _sse({'type': _type, 'content': chunk})
+                        # 检查是否被取消
+                        if cancel_event.is_set():
+                            was_cancelled = True
+                            logger.info(f"🛑 检测到流式响应被取消，已生成内容长度: {len(full_response)}")
+                            break
             except Exception as e:
                 logger.error(f"流式生成过程中出错: {e}")
-                yield f"data: {json.dumps({'type': 'content', 'content': "抱歉，生成回复时出现错误。"}, ensure_ascii=False)}\n\n"
+                yield _sse({'type': 'content', 'content': "抱歉，生成回复时出现错误。"})
                 if not full_response:
                     full_response = "抱歉，生成回复时出现错误。"
             
-            # 处理保存逻辑
-            if was_cancelled:
-                # 如果被取消，使用ChatService的中断处理方法
-                await chat_service.handle_stream_interruption(
-                    request_id=request_id,
-                    session_id=session_id,
-                    user_message=request.message,
-                    partial_response=full_response
-                )
-            elif full_response.strip():  # 正常完成且有内容
-                try:
-                    await chat_service.save_conversation_history(
-                        session_id=session_id,
-                        user_message=request.message,
-                        assistant_message=full_response,
-                        knowledge_sources=search_result['knowledge_results'],
-                        web_search_results=search_result['web_results'],
-                        thinking_process=thinking_process if thinking_process.strip() else None
-                    )
-                    logger.info(f"💾 已保存完整的对话记录，内容长度: {len(full_response)}, 思考过程长度: {len(thinking_process)}")
-                    
-                    # 如果是新会话，异步生成并推送标题
-                    if request.is_first:
-                        try:
-                            session_title = await chat_service.generate_session_title_from_input(request.message)
-                            
-                            # 更新数据库中的会话标题
-                            db.query(ChatSession).filter(ChatSession.id == session_id).update(
-                                {"title": session_title}, synchronize_session=False
-                            )
-                            db.commit()
-                            
-                            # 推送标题更新给前端
-                            yield f"data: {json.dumps({'type': 'title_update', 'session_id': session_id, 'title': session_title}, ensure_ascii=False)}\n\n"
-                            
-                            logger.info(f"会话标题已生成并推送: {session_id} -> {session_title}")
-                            
-                        except Exception as e:
-                            logger.error(f"异步生成标题失败: {e}")
-                            # 如果生成失败，使用用户消息的前几个字符作为标题
-                            fallback_title = request.message[:10] + "..." if len(request.message) > 10 else request.message
-                            db.query(ChatSession).filter(ChatSession.id == session_id).update(
-                                {"title": fallback_title}, synchronize_session=False
-                            )
-                            db.commit()
-                            yield f"data: {json.dumps({'type': 'title_update', 'session_id': session_id, 'title': fallback_title}, ensure_ascii=False)}\n\n"
-                    
-                except Exception as e:
-                    logger.error(f"保存对话历史失败: {e}")
+            # 保存对话记录与生成标题不影响本次回复内容，放到后台任务中执行，先发送完成信号
+            persist_task = asyncio.create_task(_persist_conversation(
+                request=request,
+                request_id=request_id,
+                session_id=session_id,
+                full_response=full_response,
+                thinking_process=thinking_process,
+                knowledge_json=knowledge_json,
+                web_json=web_json,
+                was_cancelled=was_cancelled
+            ))
             
             # 发送完成信号
             response_time = time.time() - start_time
-            yield f"data: {json.dumps({
+            yield _sse({
                 'type': 'end',
                 'response_time': response_time
-            }, ensure_ascii=False)}\n\n"
+            })
+            
+            # 等待后台保存完成后推送标题更新（shield保证客户端断开时保存任务不被取消）
+            session_title = await asyncio.shield(persist_task)
+            if session_title:
+                yield _sse({'type': 'title_update', 'session_id': session_id, 'title': session_title})
+                logger.info(f"会话标题已生成并推送: {session_id} -> {session_title}")
             
         except Exception as e:
             logger.error(f"流式聊天失败: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'error': str(e)}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'error', 'error': str(e)})
         finally:
             # 清理
-            if request_id in active_streams:
-                del active_streams[request_id]
-                logger.info(f"Cleaned up active stream for request_id: {request_id}")
+            await unregister_stream(request_id)
+            # 流式响应可能长于依赖的生命周期，这里显式关闭会话归还连接
+            await db.close()
+            logger.info(f"Cleaned up active stream for request_id: {request_id}")
     
-    return StreamingResponse(
-        generate(),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Content-Type": "text/event-stream"
-        }
-    )
+    # EventSourceResponse自动设置text/event-stream、X-Accel-Buffering等响应头，并定时发送ping保持代理连接
+    return EventSourceResponse(generate(), ping=SSE_PING_INTERVAL)
 
 @router.post("/stop", summary="停止流式生成")
-async def stop_stream(
-    request_id: str = Body(..., embed=True),
-    db: Session = Depends(get_db)
-):
-    """停止一个正在进行的流式生成"""
-    if request_id not in active_streams:
-        raise HTTPException(status_code=404, detail="Request ID not found or stream already completed.")
+async def stop_stream(request_id: str = Body(..., embed=True)):
+    """停止一个正在进行的流式生成（流可能由其他worker处理，通过Redis标记通知）
     
-    # 使用ChatService处理停止逻辑
-    chat_service = ChatService(db=db)
-    success = await chat_service.stop_stream_generation(request_id)
+    只需读写取消标记，不依赖数据库会话。
+    """
+    success = await stop_stream_generation(request_id)
     
     if success:
         return {"status": "stopping"}
     else:
-        raise HTTPException(status_code=500, detail="Failed to stop stream generation.")
+        raise HTTPException(status_code=404, detail="Request ID not found or stream already completed.")
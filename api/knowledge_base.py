@@ -1,72 +1,489 @@
 """知识库API路由"""
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
-from sqlalchemy.orm import Session
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Header, Query, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import and_, case, exists, false, func, or_, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, AsyncIterator, List, Optional, Tuple
+from datetime import datetime
 import os
 import uuid
+import base64
+import asyncio
 import logging
-import aiofiles
+import io
+import hashlib
+from functools import lru_cache
+from types import MappingProxyType
+import aiofiles.os
+import orjson
+import numpy as np
 from urllib.parse import urlparse
-from core.database import get_db
+from core.database import AsyncSessionLocal, get_async_db
 from core.config import settings
-from models.schemas import BaseResponse, TaskStatus, DocumentProcessRequest, KbDocumentRequest, PostProcessRequest, DocumentQueryRequest, KnowledgeSearchRequest, DocumentGroupCreate, DocumentGroupResponse, DocumentGroupUpdate, GroupDetailRequest, DocumentDeleteRequest, DocumentGroupDeleteRequest, DocumentGroupListRequest, DocumentGroupUpdateRequest, SearchRequest
+from models.schemas import BaseResponse, TaskStatus, DocumentProcessRequest, KbDocumentRequest, PostProcessRequest, DocumentQueryRequest, KnowledgeSearchRequest, DocumentGroupCreate, DocumentGroupResponse, DocumentGroupUpdate, GroupDetailRequest, DocumentDeleteRequest, TaskStatusBatchRequest, DocumentGroupDeleteRequest, DocumentGroupListRequest, DocumentGroupUpdateRequest, SearchRequest
 from models.database import KbDocument, KbGroup
 from models.enums import DocType, TaskStatus
 from services.document_service import DocumentService
 from services.search_service import SearchService
 from services.vector_service import VectorService
 from services.tasks.embedding_tasks import process_and_embed_document_task
+from services.outbox_service import outbox_service
 from services.embedding_service import EmbeddingService
+from utils.time_utils import format_datetime
+from utils.cache_utils import cache_get_json_async, cache_set_json_async
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 上传文件分块复制大小（字节），限制单个上传复制时的内存占用
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Starlette将超过该大小（字节）的上传内容溢写到磁盘临时文件，更小的内容仍在内存中
+UPLOAD_SPOOL_MAX_SIZE = 1024 * 1024
+# 文档列表分批读取的行数
+DOCUMENT_FETCH_BATCH_SIZE = 200
+
+# 知识库搜索结果缓存时间（秒），短时间内相同查询直接复用结果
+SEARCH_CACHE_TTL = 30
+# 查询向量缓存时间（秒），相同查询文本不再重复调用嵌入模型
+QUERY_EMBEDDING_CACHE_TTL = 24 * 3600
+
+# 已结束（完成/失败）的任务状态不再变化，允许客户端缓存的时间（秒），减少轮询
+TERMINAL_TASK_CACHE_SECONDS = 60
+TERMINAL_TASK_STATUSES = frozenset({TaskStatus.COMPLETED, TaskStatus.FAILED})
+
+# 分组列表/详情的条件请求：客户端每次须带ETag向服务端确认，数据未变化时返回304
+LIST_CACHE_CONTROL = "private, must-revalidate"
+
+# 上传文件大小上限（字节），配置在运行期间不变，模块加载时换算一次
+MAX_FILE_BYTES = settings.max_file_size * 1024 * 1024
+
+# 上传目录是否已确认存在
+_upload_dir_ready = False
+# 限制并发写盘的上传数量，避免大量上传同时占满磁盘带宽与文件句柄
+upload_semaphore = asyncio.Semaphore(settings.upload_concurrency)
+# 进行中的知识库搜索，相同参数的并发请求共享同一次计算
+_inflight_searches = {}
+
 # 服务实例
 document_service = DocumentService()
 search_service = SearchService()
 vector_service = VectorService()
+embedding_service = EmbeddingService()
+
+# 文件类型映射（配置中的类型名 -> (MIME类型, 扩展名)）
+FILE_TYPE_MAPPING = MappingProxyType({
+    'pdf': ('application/pdf', '.pdf'),
+    'doc': ('application/msword', '.doc'),
+    'docx': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', '.docx'),
+    'ppt': ('application/vnd.ms-powerpoint', '.ppt'),
+    'pptx': ('application/vnd.openxmlformats-officedocument.presentationml.presentation', '.pptx'),
+    'txt': ('text/plain', '.txt'),
+    'md': ('text/markdown', '.md'),
+    'jpg': ('image/jpeg', '.jpg'),
+    'png': ('image/png', '.png'),
+    'gif': ('image/gif', '.gif')
+})
+
+# 二进制文件类型的文件头特征（MIME类型 -> 允许的字节前缀），文本类型没有固定文件头，不做校验
+_OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'  # doc/ppt等旧版Office复合文档
+_ZIP_SIGNATURE = b'PK\x03\x04'  # docx/pptx等OOXML文档
+FILE_SIGNATURES = MappingProxyType({
+    'application/pdf': (b'%PDF',),
+    'application/msword': (_OLE_SIGNATURE,),
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': (_ZIP_SIGNATURE,),
+    'application/vnd.ms-powerpoint': (_OLE_SIGNATURE,),
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': (_ZIP_SIGNATURE,),
+    'image/jpeg': (b'\xff\xd8\xff',),
+    'image/png': (b'\x89PNG\r\n\x1a\n',),
+    'image/gif': (b'GIF87a', b'GIF89a'),
+})
+# 校验文件头时读取的字节数
+FILE_SIGNATURE_PEEK_SIZE = 16
 
 # 允许的文件类型
-# 文件类型映射
-def get_allowed_file_types():
-    """根据配置获取允许的文件类型映射"""
-    type_mapping = {
-        'pdf': ('application/pdf', '.pdf'),
-        'doc': ('application/msword', '.doc'),
-        'docx': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', '.docx'),
-        'ppt': ('application/vnd.ms-powerpoint', '.ppt'),
-        'pptx': ('application/vnd.openxmlformats-officedocument.presentationml.presentation', '.pptx'),
-        'txt': ('text/plain', '.txt'),
-        'md': ('text/markdown', '.md'),
-        'jpg': ('image/jpeg', '.jpg'),
-        'png': ('image/png', '.png'),
-        'gif': ('image/gif', '.gif')
-    }
+@lru_cache(maxsize=1)
+def get_allowed_file_types() -> MappingProxyType:
+    """根据配置获取允许的文件类型映射（MIME类型 -> 扩展名）
     
+    配置在运行期间不变，结果只构建一次并以只读映射返回，可安全共享。
+    """
     allowed_types = {}
     for file_type in settings.allowed_file_types:
-        if file_type in type_mapping:
-            mime_type, extension = type_mapping[file_type]
+        if file_type in FILE_TYPE_MAPPING:
+            mime_type, extension = FILE_TYPE_MAPPING[file_type]
             allowed_types[mime_type] = extension
     
-    return allowed_types
+    return MappingProxyType(allowed_types)
+
+# 模块加载时预先构建两个方向的映射，首个上传请求无需再计算
+ALLOWED_FILE_TYPES = get_allowed_file_types()
+# 反向映射（扩展名 -> MIME类型）
+ALLOWED_EXTENSIONS = MappingProxyType({extension: mime_type for mime_type, extension in ALLOWED_FILE_TYPES.items()})
+
+def _resolve_upload_type(file: UploadFile) -> Optional[Tuple[str, str]]:
+    """确定上传文件的(MIME类型, 扩展名)，不在允许范围内时返回None
+    
+    客户端声明的content_type不可信（各浏览器对同一类型的写法不一，也常发送通用二进制类型），
+    优先按文件名扩展名判断；没有可识别的扩展名时才参考声明的类型。文件内容是否相符由文件头校验把关。
+    """
+    if file.filename:
+        extension = os.path.splitext(file.filename)[1].lower()
+        mime_type = ALLOWED_EXTENSIONS.get(extension)
+        if mime_type is not None:
+            return mime_type, extension
+    content_type = file.content_type or ''
+    extension = ALLOWED_FILE_TYPES.get(content_type)
+    if extension is not None:
+        return content_type, extension
+    return None
+
+async def _ensure_upload_dir(upload_dir: str) -> None:
+    """确保上传目录存在（首次检查后缓存结果，后续请求不再触发文件系统调用）"""
+    global _upload_dir_ready
+    if not _upload_dir_ready:
+        await aiofiles.os.makedirs(upload_dir, exist_ok=True)
+        _upload_dir_ready = True
+
+async def _matches_file_signature(file: UploadFile, mime_type: str) -> bool:
+    """读取文件开头若干字节，校验是否与声明的文件类型相符（读取后复位到开头）"""
+    signatures = FILE_SIGNATURES.get(mime_type)
+    if not signatures:
+        return True
+    head = await file.read(FILE_SIGNATURE_PEEK_SIZE)
+    await file.seek(0)
+    return head.startswith(signatures)
+
+def _file_too_large() -> HTTPException:
+    """构造上传文件超出大小限制的异常（413）"""
+    return HTTPException(status_code=413, detail=f"文件大小不能超过{settings.max_file_size:.0f}MB")
+
+def _declared_upload_size(file: UploadFile) -> int:
+    """获取客户端声明的上传文件大小，未声明时返回0
+    
+    优先使用UploadFile.size（部分部署环境不带该属性），其次读取分段的Content-Length头。
+    """
+    size = getattr(file, "size", None)
+    if size:
+        return size
+    content_length = file.headers.get("content-length", "") if file.headers else ""
+    return int(content_length) if content_length.isdigit() else 0
+
+def _sendfile_copy(src_fd: int, file_path: str, size: int) -> None:
+    """通过os.sendfile在内核态复制文件内容，不经过用户态缓冲区"""
+    dst_fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            if not sent:
+                break
+            offset += sent
+    finally:
+        os.close(dst_fd)
+
+def _upload_fileno(src) -> Optional[int]:
+    """返回已溢写到磁盘的上传内容的文件描述符，内容仍在内存中或不支持时返回None
+    
+    内容仍在内存中时调用fileno()会强制写出临时文件，因此先按大小跳过不会溢写的小文件。
+    """
+    try:
+        size = src.seek(0, os.SEEK_END)
+        src.seek(0)
+        if size <= UPLOAD_SPOOL_MAX_SIZE:
+            return None
+        return src.fileno()
+    except (io.UnsupportedOperation, AttributeError):
+        return None
+
+def _copy_upload_sync(src, file_path: str, max_file_bytes: int) -> int:
+    """分块复制上传内容到目标文件，返回读取的字节数
+    
+    超过大小上限时停止复制并删除不完整的文件（此时返回值大于上限）。
+    """
+    file_size = 0
+    with open(file_path, "wb") as out:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > max_file_bytes:
+                break
+            out.write(chunk)
+    if file_size > max_file_bytes:
+        os.remove(file_path)
+    return file_size
+
+async def _save_upload_file(file: UploadFile, file_path: str, max_file_bytes: int) -> int:
+    """保存上传文件，返回文件大小（字节）
+    
+    上传内容已由Starlette溢写到磁盘临时文件时使用sendfile零拷贝复制；
+    否则在一次线程调度内同步分块复制，边写边累计大小（不再每块切换一次线程）。
+    写盘在upload_semaphore内进行，同时占用的工作线程不超过upload_concurrency个。
+    """
+    src = file.file
+    src_fd = _upload_fileno(src) if hasattr(os, "sendfile") else None
+    if src_fd is not None:
+        file_size = os.fstat(src_fd).st_size
+        if file_size > max_file_bytes:
+            raise _file_too_large()
+        await asyncio.to_thread(_sendfile_copy, src_fd, file_path, file_size)
+    else:
+        file_size = await asyncio.to_thread(_copy_upload_sync, src, file_path, max_file_bytes)
+        if file_size > max_file_bytes:
+            raise _file_too_large()
+    return file_size
+
+async def _get_active_group(db: AsyncSession, group_id: str, user_id: str) -> Optional[KbGroup]:
+    """按主键获取属于该用户且未删除的知识库分组（优先命中会话identity map）"""
+    group = await db.get(KbGroup, group_id)
+    if group is None or group.user_id != user_id or not group.is_active:
+        return None
+    return group
+
+async def _active_group_exists(db: AsyncSession, group_id: str, user_id: str) -> bool:
+    """判断属于该用户且未删除的知识库分组是否存在（数据库仅返回布尔值，不构建ORM对象）"""
+    return bool(await db.scalar(select(exists().where(
+        KbGroup.id == group_id,
+        KbGroup.user_id == user_id,
+        KbGroup.is_active == True
+    ))))
+
+def _group_name_conflict(user_id: str, group_name: str, exclude_group_id: Optional[str] = None):
+    """构造"该用户下已存在同名未删除分组"的EXISTS条件
+    
+    子查询使用KbGroup的别名，嵌入以KbGroup为主表的查询时不会与外层自动关联。
+    """
+    other = aliased(KbGroup)
+    conditions = [
+        other.user_id == user_id,
+        other.group_name == group_name,
+        other.is_active == True
+    ]
+    if exclude_group_id is not None:
+        conditions.append(other.id != exclude_group_id)
+    return exists().where(*conditions)
+
+async def _group_name_exists(db: AsyncSession, user_id: str, group_name: str) -> bool:
+    """判断该用户下是否已存在同名的未删除知识库分组"""
+    return bool(await db.scalar(select(_group_name_conflict(user_id, group_name))))
+
+async def _get_active_document(db: AsyncSession, doc_id: str, user_id: str) -> Optional[KbDocument]:
+    """按主键获取属于该用户且未删除的文档"""
+    document = await db.get(KbDocument, doc_id)
+    if document is None or document.user_id != user_id or not document.is_active:
+        return None
+    return document
+
+def _encode_document_cursor(created_at: datetime, doc_id: str) -> str:
+    """将分页位置（创建时间, 文档ID）编码为游标字符串"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{doc_id}".encode()).decode()
+
+def _decode_document_cursor(cursor: str) -> Tuple[datetime, str]:
+    """解析分页游标，格式非法时返回400"""
+    try:
+        created_at, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), doc_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+def _make_etag(*parts) -> str:
+    """由聚合指纹生成强ETag"""
+    return '"%s"' % hashlib.md5(orjson.dumps(parts, default=str)).hexdigest()
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断If-None-Match请求头是否命中当前ETag"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def _not_modified(etag: str) -> Response:
+    """数据未变化时的304响应"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": LIST_CACHE_CONTROL})
+
+def _document_row_to_dict(row) -> dict:
+    """将文档列查询的结果行转换为响应字典（枚举列交由orjson直接序列化为其值）"""
+    (doc_id, task_id, doc_name, doc_path, doc_type, status, progress, total_chunks,
+     processed_chunks, error_message, created_at, updated_at, started_at, completed_at) = row
+    return {
+        "doc_id": doc_id,  # 使用 doc_id 作为主要标识符
+        "task_id": task_id,
+        "doc_name": doc_name,
+        "doc_path": doc_path,
+        "doc_type": doc_type,
+        "status": status,
+        "progress": progress,
+        "total_chunks": total_chunks,
+        "processed_chunks": processed_chunks,
+        "error_message": error_message,
+        "created_at": format_datetime(created_at),
+        "updated_at": format_datetime(updated_at),
+        "started_at": format_datetime(started_at),
+        "completed_at": format_datetime(completed_at)
+    }
+
+async def _stream_group_documents(group_info: dict, stmt) -> AsyncIterator[bytes]:
+    """逐批输出分组文档列表的JSON响应体
+    
+    每批yield_per行序列化后立即发送，不在内存中累积完整列表。
+    响应开始后请求级会话可能已关闭，这里使用独立的会话读取。
+    第一段包含首批文档，调用方先取出第一段再返回响应，查询失败时仍能以错误状态码响应；
+    之后读取出错时以success为false、带error字段的完整JSON结束，客户端不会收到被截断的JSON。
+    success与message放在末尾输出，确定结果后再写入。
+    """
+    async with AsyncSessionLocal() as db:
+        rows = await db.stream(stmt)
+        partitions = rows.partitions()
+        first_partition = await anext(partitions, [])
+        yield (
+            b'{"data":{"group_info":' + orjson.dumps(group_info) + b',"documents":['
+            + b",".join(orjson.dumps(_document_row_to_dict(row)) for row in first_partition)
+        )
+        total_count = len(first_partition)
+        try:
+            async for partition in partitions:
+                chunk = b",".join(orjson.dumps(_document_row_to_dict(row)) for row in partition)
+                yield (b"," + chunk) if total_count else chunk
+                total_count += len(partition)
+        except Exception as e:
+            logger.error("输出分组知识列表失败: %s", e)
+            yield (
+                b'],"total_count":null,"next_cursor":null,"error":' + orjson.dumps("读取文档列表中断")
+                + b'},"success":false,"message":' + orjson.dumps("获取分组知识列表失败") + b'}'
+            )
+            return
+    yield (
+        b'],"total_count":' + str(total_count).encode() + b',"next_cursor":null}'
+        + b',"success":true,"message":' + orjson.dumps("获取分组知识列表成功") + b'}'
+    )
+
+async def _prepend_chunk(first_chunk: bytes, rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """先输出已取出的第一段，再继续输出剩余内容"""
+    yield first_chunk
+    async for chunk in rest:
+        yield chunk
+
+# 任务状态查询返回的列
+TASK_STATUS_COLUMNS = (
+    KbDocument.task_id,
+    KbDocument.doc_name,
+    KbDocument.status,
+    KbDocument.progress,
+    KbDocument.total_chunks,
+    KbDocument.processed_chunks,
+    KbDocument.error_message,
+    KbDocument.created_at,
+    KbDocument.started_at,
+    KbDocument.completed_at
+)
+
+def _task_status_row_to_dict(row) -> dict:
+    """将任务状态查询的结果行转换为响应字典，时间字段与其他接口统一格式"""
+    data = row._asdict()
+    for key in ("created_at", "started_at", "completed_at"):
+        data[key] = format_datetime(data[key])
+    return data
+
+def _idempotent_doc_id(user_id: str, idempotency_key: str) -> str:
+    """由用户ID与客户端幂等键确定性地生成doc_id，同一请求重试时得到相同的主键"""
+    return hashlib.sha1(f"{user_id}\0{idempotency_key}".encode()).hexdigest()[:32]
+
+async def _commit_new_task(db: AsyncSession, embedding_task: KbDocument, task_request: KbDocumentRequest) -> Optional[KbDocument]:
+    """写入新的任务记录并登记嵌入任务，成功返回None
+    
+    任务记录与发件箱记录在同一事务中提交，由后台投递器发送到Celery，请求无需等待broker往返。
+    以doc_id主键的唯一性代替写入前的查重：携带相同幂等键的并发请求已先写入时主键冲突，
+    回滚后返回已有记录；其他完整性错误照常抛出。
+    """
+    db.add(embedding_task)
+    outbox_service.add_task(
+        db,
+        process_and_embed_document_task.name,
+        embedding_task.task_id,
+        [task_request.model_dump()]
+    )
+    try:
+        await db.commit()
+        outbox_service.notify()
+        return None
+    except IntegrityError:
+        await db.rollback()
+        existing = await db.get(KbDocument, embedding_task.doc_id)
+        if existing is None:
+            raise
+        return existing
+
+async def _get_query_embedding(query: str) -> List[float]:
+    """获取查询文本的嵌入向量，按规范化后的文本与模型缓存到Redis"""
+    normalized = " ".join(query.split())
+    cache_key = "emb:" + hashlib.sha1(f"{embedding_service.default_model}\0{normalized}".encode()).hexdigest()
+    embedding = await cache_get_json_async(cache_key)
+    if embedding:
+        return embedding
+    
+    embedding = await embedding_service.generate_embedding(query)
+    # Milvus向量字段为FLOAT_VECTOR（float32），按float32精度缓存不影响检索结果，缓存体积约减半
+    await cache_set_json_async(
+        cache_key,
+        np.asarray(embedding, dtype=np.float32),
+        QUERY_EMBEDDING_CACHE_TTL,
+        option=orjson.OPT_SERIALIZE_NUMPY
+    )
+    return embedding
+
+async def _run_knowledge_search(request: KnowledgeSearchRequest, cache_key: str) -> list:
+    """执行知识库搜索并写入短时缓存"""
+    results = await search_service.knowledge_search(
+        query=request.query,
+        top_k=request.top_k,
+        similarity_threshold=request.similarity_threshold,
+        collection_name=request.collection_name,
+        group_id=request.group_id,
+        user_id=request.user_id
+    )
+    # 搜索失败时返回空列表，不缓存，避免短时间内持续返回空结果
+    if results:
+        await cache_set_json_async(cache_key, results, SEARCH_CACHE_TTL)
+    return results
+
+async def _search_knowledge_once(request: KnowledgeSearchRequest) -> list:
+    """执行知识库搜索，合并重复请求
+    
+    先读短时缓存；未命中时相同参数的并发请求等待同一个进行中的任务，
+    只做一次向量化与Milvus检索。
+    """
+    params = (
+        request.query,
+        request.top_k,
+        request.similarity_threshold,
+        request.collection_name,
+        request.group_id,
+        request.user_id
+    )
+    cache_key = "kb_search:" + hashlib.sha1(orjson.dumps(params)).hexdigest()
+    results = await cache_get_json_async(cache_key)
+    if results is not None:
+        return results
+    
+    task = _inflight_searches.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_run_knowledge_search(request, cache_key))
+        _inflight_searches[cache_key] = task
+        task.add_done_callback(lambda _: _inflight_searches.pop(cache_key, None))
+    
+    # shield：某个请求断开不会取消其他请求正在等待的共享任务
+    return await asyncio.shield(task)
 
 # ===== 知识库分组管理接口 =====
 # 知识库分组管理接口
 @router.post("/group/create_group", response_model=BaseResponse)
 async def create_document_group(
     request: DocumentGroupCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建知识库分组"""
     try:
         # 检查同一用户下是否已存在相同名称的知识库
-        existing_group = db.query(KbGroup).filter(
-            KbGroup.user_id == request.user_id,
-            KbGroup.group_name == request.group_name,
-            KbGroup.is_active == True
-        ).first()
-        
-        if existing_group:
+        if await _group_name_exists(db, request.user_id, request.group_name):
             raise HTTPException(
                 status_code=400,
                 detail=f"知识库 '{request.group_name}' 已存在"
@@ -80,97 +497,137 @@ async def create_document_group(
         )
         
         db.add(new_group)
-        db.commit()
-        db.refresh(new_group)
+        # flush后主键与默认值已在本地对象上，提交前构建响应，避免commit后属性过期再refresh查询
+        await db.flush()
+        group_data = {
+            "group_id": str(new_group.id),  # 确保返回字符串类型
+            "group_name": new_group.group_name,
+            "description": new_group.description,
+            "created_at": format_datetime(new_group.created_at)
+        }
+        await db.commit()
         
         return BaseResponse(
             success=True,
             message="知识库创建成功",
-            data={
-                "group_id": str(new_group.id),  # 确保返回字符串类型
-                "group_name": new_group.group_name,
-                "description": new_group.description,
-                "created_at": new_group.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            }
+            data=group_data
         )
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"创建知识库分组失败: {str(e)}")
-        db.rollback()
+        logger.error("创建知识库分组失败: %s", e)
+        await db.rollback()
         raise HTTPException(status_code=500, detail="创建知识库分组失败")
 
-@router.post("/group/get_groups", response_model=BaseResponse)
-async def get_document_groups(
+async def _list_document_groups(
     request: DocumentGroupListRequest,
-    db: Session = Depends(get_db)
+    if_none_match: Optional[str],
+    db: AsyncSession
 ):
-    """获取用户的知识库分组列表"""
+    """查询用户的知识库分组列表
+    
+    响应带ETag；传入的If-None-Match命中时返回304，不再传输列表内容。
+    分组列表只需一次聚合查询，ETag直接由列表内容生成，同一秒内的多次修改也能体现在ETag中。
+    """
     try:
         # 如果没有提供user_id，使用默认用户ID
         user_id = request.user_id or settings.default_user_id
         
-        groups = db.query(KbGroup).filter(
-            KbGroup.user_id == user_id,
-            KbGroup.is_active == True
-        ).order_by(KbGroup.created_at.desc()).all()
+        # 分组与文档数量一次查询返回：外连接有效文档后按分组聚合，避免逐个分组COUNT（N+1查询）
+        rows = (await db.execute(
+            select(
+                KbGroup.id,
+                KbGroup.group_name,
+                KbGroup.description,
+                KbGroup.created_at,
+                KbGroup.updated_at,
+                func.count(KbDocument.doc_id).label("task_count")
+            ).outerjoin(
+                KbDocument,
+                and_(
+                    KbDocument.group_id == KbGroup.id,
+                    KbDocument.user_id == user_id,
+                    KbDocument.is_active == True
+                )
+            ).where(
+                KbGroup.user_id == user_id,
+                KbGroup.is_active == True
+            ).group_by(KbGroup.id).order_by(KbGroup.created_at.desc())
+        )).all()
+        
         groups_data = []
-        for group in groups:
-            # 统计该分组下的任务数量
-            task_count = db.query(KbDocument).filter(
-                KbGroup.id == group.id,
-                KbGroup.user_id == user_id
-            ).count()
+        for row in rows:
             groups_data.append({
-                "id": str(group.id),  # 确保返回字符串类型
-                "group_name": group.group_name,
-                "description": group.description,
-                "task_count": task_count,
-                "created_at": group.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                "updated_at": group.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+                "id": str(row.id),  # 确保返回字符串类型
+                "group_name": row.group_name,
+                "description": row.description,
+                "task_count": row.task_count,
+                "created_at": format_datetime(row.created_at),
+                "updated_at": format_datetime(row.updated_at)
             })
         
-        return BaseResponse(
-            success=True,
-            message="获取知识库列表成功",
-            data=groups_data
-        )
+        etag = _make_etag(user_id, groups_data)
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+        
+        # 直接返回已构建好的字典，跳过BaseResponse的二次校验
+        return ORJSONResponse({
+            "success": True,
+            "message": "获取知识库列表成功",
+            "data": groups_data
+        }, headers={"ETag": etag, "Cache-Control": LIST_CACHE_CONTROL})
         
     except Exception as e:
-        logger.error(f"获取知识库分组列表失败: {str(e)}")
+        logger.error("获取知识库分组列表失败: %s", e)
         raise HTTPException(status_code=500, detail="获取知识库分组列表失败")
 
+@router.post("/group/get_groups", response_model=BaseResponse)
+async def get_document_groups(
+    request: DocumentGroupListRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取用户的知识库分组列表（条件请求仅适用于GET，POST总是返回完整列表）"""
+    return await _list_document_groups(request, None, db)
+
+@router.get("/group/get_groups", response_model=BaseResponse)
+async def get_document_groups_conditional(
+    request: Annotated[DocumentGroupListRequest, Query()],
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取用户的知识库分组列表（GET查询参数版本，可被浏览器与HTTP缓存按ETag重新验证）"""
+    return await _list_document_groups(request, if_none_match, db)
+
 @router.post("/group/update_group", response_model=BaseResponse)
 async def update_document_group(
     request: DocumentGroupUpdateRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新知识库分组信息"""
     try:
         # 如果没有提供user_id，使用默认用户ID
         user_id = request.user_id or settings.default_user_id
         
-        # 查找指定的知识库分组
-        group = db.query(KbGroup).filter(
-            KbGroup.id == request.group_id,
-            KbGroup.user_id == user_id,
-            KbGroup.is_active == True
-        ).first()
+        # 查找指定的知识库分组，同一查询中检查新名称是否与其他知识库冲突
+        name_taken = (
+            _group_name_conflict(user_id, request.group_name, request.group_id)
+            if request.group_name is not None else false()
+        )
+        row = (await db.execute(
+            select(KbGroup, name_taken.label("name_taken")).where(
+                KbGroup.id == request.group_id,
+                KbGroup.user_id == user_id,
+                KbGroup.is_active == True
+            )
+        )).first()
         
-        if not group:
+        if not row:
             raise HTTPException(status_code=404, detail="知识库分组不存在")
+        group, name_taken = row
         
         # 更新字段
         if request.group_name is not None:
-            # 检查新名称是否与其他知识库冲突
-            existing_group = db.query(KbGroup).filter(
-                KbGroup.user_id == user_id,
-                KbGroup.group_name == request.group_name,
-                KbGroup.id != request.group_id,
-                KbGroup.is_active == True
-            ).first()
-            
-            if existing_group:
+            if name_taken:
                 raise HTTPException(
                     status_code=400,
                     detail=f"知识库名称 '{request.group_name}' 已存在"
@@ -181,52 +638,52 @@ async def update_document_group(
         if request.description is not None:
             group.description = request.description
         
-        db.commit()
-        db.refresh(group)
+        # flush后onupdate的更新时间已写回本地对象，提交前构建响应，无需refresh
+        await db.flush()
+        group_data = {
+            "id": group.id,
+            "group_name": group.group_name,
+            "description": group.description,
+            "updated_at": format_datetime(group.updated_at)
+        }
+        await db.commit()
         
         return BaseResponse(
             success=True,
             message="知识库更新成功",
-            data={
-                "id": group.id,
-                "group_name": group.group_name,
-                "description": group.description,
-                "updated_at": group.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-            }
+            data=group_data
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"更新知识库分组失败: {str(e)}")
-        db.rollback()
+        logger.error("更新知识库分组失败: %s", e)
+        await db.rollback()
         raise HTTPException(status_code=500, detail="更新知识库分组失败")
 
 @router.post("/group/delete_group", response_model=BaseResponse)
 async def delete_document_group(
     request: DocumentGroupDeleteRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除知识库分组（软删除）"""
     try:
         # 查找指定的知识库分组
-        group = db.query(KbGroup).filter(
-            KbGroup.id == request.group_id,
-            KbGroup.user_id == request.user_id,
-            KbGroup.is_active == True
-        ).first()
+        group = await _get_active_group(db, request.group_id, request.user_id)
         
         if not group:
             raise HTTPException(status_code=404, detail="知识库分组不存在")
         
-        # 检查该分组下是否还有未删除的子文档
-        active_documents = db.query(KbDocument).filter(
-            KbGroup.id == request.group_id,
-            KbGroup.user_id == request.user_id,
-            KbGroup.is_active == True
-        ).count()
-        
-        if active_documents > 0:
+        # 检查该分组下是否还有未删除的子文档：先用EXISTS判断（命中首行即返回），仅在需要提示数量时再计数
+        active_conditions = (
+            KbDocument.group_id == request.group_id,
+            KbDocument.user_id == request.user_id,
+            KbDocument.is_active == True
+        )
+        if await db.scalar(select(exists().where(*active_conditions))):
+            active_documents = await db.scalar(
+                select(func.count(KbDocument.doc_id)).where(*active_conditions)
+            )
             return BaseResponse(
                 success=False,
                 message=f"无法删除知识库分组，该分组下还有 {active_documents} 个未删除的文档，请先删除所有文档后再删除分组",
@@ -235,7 +692,7 @@ async def delete_document_group(
         
         # 软删除
         group.is_active = False
-        db.commit()
+        await db.commit()
         
         return BaseResponse(
             success=True,
@@ -245,92 +702,204 @@ async def delete_document_group(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"删除知识库分组失败: {str(e)}")
-        db.rollback()
+        logger.error("删除知识库分组失败: %s", e)
+        await db.rollback()
         raise HTTPException(status_code=500, detail="删除知识库分组失败")
 
-@router.post("/group/detail", response_model=BaseResponse)
-async def get_group_documents(
+async def _list_group_documents(
     request: GroupDetailRequest,
-    db: Session = Depends(get_db)
+    if_none_match: Optional[str],
+    db: AsyncSession
 ):
-    """获取指定分组内的知识列表"""
+    """查询指定分组内的知识列表
+    
+    响应带ETag；传入的If-None-Match命中时返回304，不再执行文档查询与序列化。
+    """
     try:
         # 如果没有提供user_id，使用默认用户ID
         user_id = request.user_id or settings.default_user_id
         
         # 验证分组是否存在且属于该用户
-        group = db.query(KbGroup).filter(
-            KbGroup.id == request.group_id,
-            KbGroup.user_id == user_id,
-            KbGroup.is_active == True
-        ).first()
+        group = await _get_active_group(db, request.group_id, user_id)
         
         if not group:
             raise HTTPException(status_code=404, detail="知识库分组不存在")
         
-        # 获取该分组下的所有文档任务（排除已删除的）
-        documents = db.query(KbDocument).filter(
+        conditions = [
             KbDocument.group_id == request.group_id,
             KbDocument.user_id == user_id,
             KbDocument.is_active == True  # 排除已删除的文档
-        ).order_by(KbDocument.created_at.desc()).all()
+        ]
         
+        # 以一次聚合查询作为文档列表指纹：时间戳只精确到秒，另外按状态计数并累计进度与分块数，
+        # 状态变化（如处理中->失败而进度不变）或同一秒内的多次更新也会改变指纹
+        fingerprint = (await db.execute(
+            select(
+                func.count(),
+                *(func.sum(case((KbDocument.status == status, 1), else_=0)) for status in TaskStatus),
+                func.sum(KbDocument.progress),
+                func.sum(KbDocument.processed_chunks),
+                func.sum(KbDocument.total_chunks),
+                func.max(KbDocument.updated_at),
+                func.max(KbDocument.completed_at)
+            ).select_from(KbDocument).where(*conditions)
+        )).one()
+        etag = _make_etag(
+            user_id, group.id, group.group_name, group.description, group.updated_at,
+            request.limit, request.cursor, *fingerprint
+        )
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+        cache_headers = {"ETag": etag, "Cache-Control": LIST_CACHE_CONTROL}
+        
+        total_count = None
+        if request.limit is not None:
+            if request.cursor:
+                # 游标（seek）分页：从上一页最后一条之后继续，耗时与页码无关
+                cursor_created_at, cursor_doc_id = _decode_document_cursor(request.cursor)
+                conditions.append(or_(
+                    KbDocument.created_at < cursor_created_at,
+                    and_(KbDocument.created_at == cursor_created_at, KbDocument.doc_id < cursor_doc_id)
+                ))
+            else:
+                # 首页总数即指纹中的有效文档数量，无需再次统计
+                total_count = fingerprint[0]
+        
+        # 获取该分组下的文档任务（排除已删除的）
+        # 只查询需要的列并用yield_per分批流式读取，不构建ORM对象
+        stmt = (
+            select(
+                KbDocument.doc_id,
+                KbDocument.task_id,
+                KbDocument.doc_name,
+                KbDocument.doc_path,
+                KbDocument.doc_type,
+                KbDocument.status,
+                KbDocument.progress,
+                KbDocument.total_chunks,
+                KbDocument.processed_chunks,
+                KbDocument.error_message,
+                KbDocument.created_at,
+                KbDocument.updated_at,
+                KbDocument.started_at,
+                KbDocument.completed_at
+            )
+            .where(*conditions)
+            .order_by(KbDocument.created_at.desc(), KbDocument.doc_id.desc())
+            .execution_options(yield_per=DOCUMENT_FETCH_BATCH_SIZE)
+        )
+        
+        group_info = {
+            "id": str(group.id),  # 确保返回字符串类型
+            "group_name": group.group_name,
+            "description": group.description,
+            "created_at": format_datetime(group.created_at),
+            "updated_at": format_datetime(group.updated_at)
+        }
+        
+        if request.limit is None:
+            # 未分页时流式输出全部文档，峰值内存只与单批行数有关
+            # 首批文档读取成功后才确定返回200，查询失败时由下方异常处理返回500
+            body = _stream_group_documents(group_info, stmt)
+            first_chunk = await anext(body)
+            return StreamingResponse(
+                _prepend_chunk(first_chunk, body),
+                media_type="application/json",
+                headers=cache_headers
+            )
+        
+        # 多取一条用于判断是否还有下一页
+        rows = await db.stream(stmt.limit(request.limit + 1))
         documents_data = []
-        for doc in documents:
-            documents_data.append({
-                "doc_id": doc.doc_id,  # 使用 doc_id 作为主要标识符
-                "task_id": doc.task_id,
-                "doc_name": doc.doc_name,
-                "doc_path": doc.doc_path,
-                "doc_type": doc.doc_type.value if doc.doc_type else None,
-                "status": doc.status.value,
-                "progress": doc.progress,
-                "total_chunks": doc.total_chunks,
-                "processed_chunks": doc.processed_chunks,
-                "error_message": doc.error_message,
-                "created_at": doc.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                "updated_at": doc.updated_at.strftime('%Y-%m-%d %H:%M:%S'),
-                "started_at": doc.started_at.strftime('%Y-%m-%d %H:%M:%S') if doc.started_at else None,
-                "completed_at": doc.completed_at.strftime('%Y-%m-%d %H:%M:%S') if doc.completed_at else None
-            })
+        next_cursor = None
+        async for row in rows:
+            if len(documents_data) == request.limit:
+                # 多取的一条说明还有下一页，游标指向本页最后一条
+                next_cursor = _encode_document_cursor(*last_position)
+                break
+            documents_data.append(_document_row_to_dict(row))
+            last_position = (row.created_at, row.doc_id)
+        await rows.close()
         
-        return BaseResponse(
-            success=True,
-            message="获取分组知识列表成功",
-            data={
-                "group_info": {
-                    "id": str(group.id),  # 确保返回字符串类型
-                    "group_name": group.group_name,
-                    "description": group.description,
-                    "created_at": group.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    "updated_at": group.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-                },
+        # 直接返回已构建好的字典，跳过BaseResponse的二次校验
+        return ORJSONResponse({
+            "success": True,
+            "message": "获取分组知识列表成功",
+            "data": {
+                "group_info": group_info,
                 "documents": documents_data,
-                "total_count": len(documents_data)
+                "total_count": total_count,
+                "next_cursor": next_cursor
             }
-        )
+        }, headers=cache_headers)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"获取分组知识列表失败: {str(e)}")
+        logger.error("获取分组知识列表失败: %s", e)
         raise HTTPException(status_code=500, detail="获取分组知识列表失败")
 
+@router.post("/group/detail", response_model=BaseResponse)
+async def get_group_documents(
+    request: GroupDetailRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取指定分组内的知识列表（条件请求仅适用于GET，POST总是返回完整列表）"""
+    return await _list_group_documents(request, None, db)
+
+@router.get("/group/detail", response_model=BaseResponse)
+async def get_group_documents_conditional(
+    request: Annotated[GroupDetailRequest, Query()],
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取指定分组内的知识列表（GET查询参数版本，可被浏览器与HTTP缓存按ETag重新验证）"""
+    return await _list_group_documents(request, if_none_match, db)
+
 # ===== 任务管理接口 =====
+def _file_task_response(task_id: str, filename: str, status: TaskStatus) -> BaseResponse:
+    """文档处理任务提交成功的响应"""
+    return BaseResponse(
+        success=True,
+        message="文档处理任务已提交，正在后台处理",
+        data={
+            "task_id": task_id,
+            "filename": filename,
+            "status": status.value
+        }
+    )
+
+def _post_task_response(task_id: str, doc_title: str, doc_id: str, status: TaskStatus) -> BaseResponse:
+    """文本处理任务提交成功的响应"""
+    return BaseResponse(
+        success=True,
+        message="文本处理任务已提交，正在后台处理",
+        data={
+            "task_id": task_id,
+            "doc_title": doc_title,
+            "doc_id": doc_id,
+            "status": status.value
+        }
+    )
+
 @router.post("/tasks/file_process", response_model=BaseResponse)
 async def process_document(
     file: Optional[UploadFile] = File(None),
     group_id: Optional[str] = Form(None),
     user_id_form: Optional[str] = Form(None),
+    file_url_form: Optional[str] = Form(None, alias="file_url"),
     request: Optional[DocumentProcessRequest] = None,
-    db: Session = Depends(get_db)
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """文档处理接口 - 支持二进制文件或文件链接"""
+    """文档处理接口 - 支持二进制文件或文件链接
+    
+    携带Idempotency-Key请求头时，同一用户以相同键重试只会创建一个任务。
+    """
     try:
         # 验证输入参数
-        file_url = request.file_url if request else None
-        # 兼容 multipart/form-data 的 user_id 字段
+        # 兼容 multipart/form-data 的 file_url 与 user_id 字段
+        file_url = file_url_form or (request.file_url if request else None)
         user_id = user_id_form or (request.user_id if request else None)
         
         if not file and not file_url:
@@ -349,53 +918,71 @@ async def process_document(
         actual_user_id = user_id if user_id else settings.default_user_id
         doc_type = ""
         file_path = ""
-        doc_id = uuid.uuid4().hex
         filename = ""  # 任务显示名，避免未赋值导致异常
+        # 每个请求只取一次随机源：Celery任务ID、文档ID与上传文件名均由同一个UUID派生，便于排查时相互对应
+        request_uuid = uuid.uuid4()
+        task_id = str(request_uuid)
+        if idempotency_key:
+            # 重试请求直接返回已创建的任务，不再重复写盘与入队
+            doc_id = _idempotent_doc_id(actual_user_id, idempotency_key)
+            existing = await db.get(KbDocument, doc_id)
+            if existing:
+                return _file_task_response(existing.task_id, existing.doc_name, existing.status)
+        else:
+            doc_id = request_uuid.hex
         if file:
             doc_type = DocType.FILE
-            # 处理上传文件
-            allowed_file_types = get_allowed_file_types()
-            
-            # 检查文件类型
-            if file.content_type not in allowed_file_types:
+            # 检查文件类型（查找同时完成校验与扩展名获取）
+            resolved_type = _resolve_upload_type(file)
+            if resolved_type is None:
                 raise HTTPException(
                     status_code=400, 
-                    detail=f"不支持的文件类型: {file.content_type}"
+                    detail=f"不支持的文件类型: {file.filename or file.content_type}"
                 )
+            mime_type, file_extension = resolved_type
             
-            # 检查文件大小限制（部分部署环境 UploadFile 不带 size 属性，做保护）
-            if hasattr(file, "size") and file.size and file.size > settings.max_file_size * 1024 * 1024:
-                raise HTTPException(status_code=400, detail=f"文件大小不能超过{settings.max_file_size:.0f}MB")
+            # 写盘前按声明大小快速拒绝；声明不可信时由写入过程中的累计大小兜底
+            if _declared_upload_size(file) > MAX_FILE_BYTES:
+                raise _file_too_large()
             
-            # 生成唯一文件名
-            file_extension = allowed_file_types[file.content_type]
-            unique_filename = f"{doc_id}{file_extension}"
+            # 写盘前校验文件头，内容与类型不符的文件只读取少量字节即被拒绝
+            if not await _matches_file_signature(file, mime_type):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"文件内容与文件类型不符: {mime_type}"
+                )
+            
+            # 生成唯一文件名（幂等请求的doc_id是确定的，文件名取本次请求的UUID，避免并发重试写入同一文件）
+            unique_filename = f"{request_uuid.hex}{file_extension}"
             
             # 使用配置的上传目录
             upload_dir = settings.upload_dir
             file_path = os.path.join(upload_dir, unique_filename)
             
             # 保存文件
-            async with aiofiles.open(file_path, "wb") as buffer:
-                content = await file.read()
-                await buffer.write(content)
+            await _ensure_upload_dir(upload_dir)
+            async with upload_semaphore:
+                await _save_upload_file(file, file_path, MAX_FILE_BYTES)
             
             # 使用原始文件名作为展示名称，若缺失则退回唯一文件名
             original_filename = os.path.basename(file.filename) if getattr(file, "filename", None) else unique_filename
             filename = original_filename
         else:
-            doc_type = DocType.URL
-            # 验证URL格式
+            # 链接按文件类型入库，由嵌入任务识别http(s)链接后下载处理
+            doc_type = DocType.FILE
+            # 验证URL格式（任务只下载http/https链接，其他协议会被当作本地路径）
             parsed_url = urlparse(file_url)
-            if not parsed_url.scheme or not parsed_url.netloc:
+            if parsed_url.scheme not in ('http', 'https') or not parsed_url.netloc:
                 raise HTTPException(status_code=400, detail="无效的文件链接")
             # 获取文件名
             filename = os.path.basename(parsed_url.path)
             if not filename:
                 filename = f"download_{doc_id}"
+        
         # 先保存任务记录到数据库（使用 doc_id 作为主键）
         embedding_task = KbDocument(
             doc_id=doc_id,  # 使用 doc_id 作为主键
+            task_id=task_id,
             user_id=actual_user_id,
             group_id=group_id,  # 修复：写入分组ID
             doc_name=filename,
@@ -407,11 +994,7 @@ async def process_document(
             processed_chunks=0,
             error_message=None
         )
-        db.add(embedding_task)
-        db.commit()
-        db.refresh(embedding_task)
-        
-        # 提交Celery任务处理嵌入
+        # 嵌入任务参数，与任务记录一起提交
         task_request = KbDocumentRequest(
             file_path=file_path or file_url,
             doc_type=doc_type,
@@ -421,36 +1004,31 @@ async def process_document(
             user_id=actual_user_id,
             group_id=group_id  # 修复：写入分组ID
         )
-        celery_task = process_and_embed_document_task.delay(task_request.dict())
-        task_id = celery_task.id
+        existing = await _commit_new_task(db, embedding_task, task_request)
+        if existing:
+            # 并发的重复请求已创建任务，删除本次写入的文件
+            if file_path:
+                await aiofiles.os.remove(file_path)
+            return _file_task_response(existing.task_id, existing.doc_name, existing.status)
         
-        # 根据 doc_id 更新真实 task_id（避免并发下空字符串主键冲突）
-        db.query(KbDocument).filter(
-            KbDocument.doc_id == doc_id,
-            KbDocument.user_id == actual_user_id
-        ).update({"task_id": task_id}, synchronize_session=False)
-        db.commit()
-        
-        return BaseResponse(
-            success=True,
-            message="文档处理任务已提交，正在后台处理",
-            data={
-                "task_id": task_id,
-                "filename": embedding_task.doc_name,
-                "status": embedding_task.status.value
-            }
-        )
+        return _file_task_response(task_id, filename, TaskStatus.PENDING)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"文档处理失败: {e}")
+        logger.error("文档处理失败: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/tasks/post_process", response_model=BaseResponse)
 async def process_post_content(
     request: PostProcessRequest,
-    db: Session = Depends(get_db)
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """POST类型文档处理接口 - 处理纯文本内容（合并了原 upload_text_document 功能）"""
+    """POST类型文档处理接口 - 处理纯文本内容（合并了原 upload_text_document 功能）
+    
+    携带Idempotency-Key请求头时，同一用户以相同键重试只会创建一个任务。
+    """
     try:
         # 验证输入参数
         if not request.content or not request.content.strip():
@@ -461,22 +1039,27 @@ async def process_post_content(
         
         # 如果提供了 group_id，验证知识库分组是否存在
         if request.group_id:
-            group = db.query(KbGroup).filter(
-                KbGroup.id == request.group_id,
-                KbGroup.user_id == request.user_id,
-                KbGroup.is_active == True
-            ).first()
-            
-            if not group:
+            if not await _active_group_exists(db, request.group_id, request.user_id):
                 raise HTTPException(status_code=404, detail="知识库分组不存在")
         
         # 处理任务参数
-        doc_id = uuid.uuid4().hex
+        # 预先生成Celery任务ID（与Celery默认格式一致），随任务记录一次写入；非幂等请求的doc_id取同一UUID
+        request_uuid = uuid.uuid4()
+        task_id = str(request_uuid)
+        if idempotency_key:
+            # 重试请求直接返回已创建的任务，不再重复入队
+            doc_id = _idempotent_doc_id(request.user_id, idempotency_key)
+            existing = await db.get(KbDocument, doc_id)
+            if existing:
+                return _post_task_response(existing.task_id, existing.doc_name, doc_id, existing.status)
+        else:
+            doc_id = request_uuid.hex
         doc_title = request.title if request.title else f"POST文档_{doc_id[:8]}"
         
         # 先保存任务记录到数据库（使用 doc_id 作为主键）
         embedding_task = KbDocument(
             doc_id=doc_id,  # 使用 doc_id 作为主键
+            task_id=task_id,
             user_id=request.user_id,
             group_id=request.group_id,  # 修复：写入分组ID
             doc_name=doc_title,
@@ -488,11 +1071,7 @@ async def process_post_content(
             processed_chunks=0,
             error_message=None
         )
-        db.add(embedding_task)
-        db.commit()
-        db.refresh(embedding_task)
-        
-        # 提交Celery任务处理嵌入
+        # 嵌入任务参数，与任务记录一起提交（内容随发件箱记录持久化，任务重投时仍可用）
         task_request = KbDocumentRequest(
             file_path=request.source_url,
             doc_type=DocType.POST,
@@ -502,89 +1081,101 @@ async def process_post_content(
             user_id=request.user_id,
             group_id=request.group_id
         )
-        celery_task = process_and_embed_document_task.delay(task_request.dict())
-        task_id = celery_task.id
+        existing = await _commit_new_task(db, embedding_task, task_request)
+        if existing:
+            return _post_task_response(existing.task_id, existing.doc_name, doc_id, existing.status)
         
-        # 根据 doc_id 更新真实 task_id（避免并发下空字符串主键冲突）
-        db.query(KbDocument).filter(
-            KbGroup.id == doc_id,
-            KbGroup.user_id == request.user_id
-        ).update({"task_id": task_id}, synchronize_session=False)
-        db.commit()
-        
-        return BaseResponse(
-            success=True,
-            message="文本处理任务已提交，正在后台处理",
-            data={
-                "task_id": task_id,
-                "doc_title": doc_title,
-                "doc_id": doc_id,
-                "status": "pending"
-            }
-        )
+        return _post_task_response(task_id, doc_title, doc_id, TaskStatus.PENDING)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"文本处理失败: {e}")
-        db.rollback()
+        logger.error("文本处理失败: %s", e)
+        await db.rollback()
         raise HTTPException(status_code=500, detail="文本处理失败")
 
+@router.post("/tasks/status", response_model=BaseResponse)
+async def get_task_status_batch(
+    request: TaskStatusBatchRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """批量获取任务状态（一次请求、一次查询返回多个任务，按task_id索引，不存在的任务不返回）"""
+    try:
+        rows = (await db.execute(
+            select(*TASK_STATUS_COLUMNS).where(KbDocument.task_id.in_(set(request.task_ids)))
+        )).all()
+        
+        return ORJSONResponse({
+            "success": True,
+            "message": "获取任务状态成功",
+            "data": {row.task_id: _task_status_row_to_dict(row) for row in rows}
+        })
+    except Exception as e:
+        logger.error("批量获取任务状态失败: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/tasks/{task_id}", response_model=BaseResponse)
 async def get_task_status(
     task_id: str,
-    db: Session = Depends(get_db)
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取任务状态"""
     try:
-        task = db.query(KbDocument).filter(
-            KbDocument.task_id == task_id
-        ).first()
+        task = (await db.execute(
+            select(*TASK_STATUS_COLUMNS).where(KbDocument.task_id == task_id).limit(1)
+        )).first()
         if not task:
             raise HTTPException(status_code=404, detail="任务不存在")
+        if task.status in TERMINAL_TASK_STATUSES:
+            response.headers["Cache-Control"] = f"max-age={TERMINAL_TASK_CACHE_SECONDS}"
         return BaseResponse(
             success=True,
             message="获取任务状态成功",
-            data={
-                "task_id": task.task_id,
-                "doc_name": task.doc_name,
-                "status": task.status.value,
-                "progress": task.progress,
-                "total_chunks": task.total_chunks,
-                "processed_chunks": task.processed_chunks,
-                "error_message": task.error_message,
-                "created_at": task.created_at,
-                "started_at": task.started_at,
-                "completed_at": task.completed_at
-            }
+            data=_task_status_row_to_dict(task)
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"获取任务状态失败: {e}")
+        logger.error("获取任务状态失败: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # ===== 知识库查询接口 =====
 @router.post("/query", response_model=BaseResponse)
 async def query_knowledge_base(
-    request: DocumentQueryRequest,
-    db: Session = Depends(get_db)
+    request: DocumentQueryRequest
 ):
     """查询知识库文档"""
     try:
-        # 使用向量服务进行搜索
-        await vector_service.connect()
-        embedding_service = EmbeddingService()
-        # 生成查询向量
-        query_embedding = await embedding_service.generate_embedding(request.query)
-        
-        # 执行向量搜索
-        results = await vector_service.search_vectors_async(
-            collection_name=request.collection_name or 'sparklinkai_knowledge',
-            query_embedding=query_embedding,
-            top_k=request.top_k,
-            similarity_threshold=request.similarity_threshold,
-            user_id=request.user_id,
-            group_id=request.group_id
-        )
+        collection_name = request.collection_name or 'sparklinkai_knowledge'
+        # 相同查询条件的结果短时缓存，命中时跳过向量化与Milvus检索
+        cache_key = "kb_query:" + hashlib.sha1(orjson.dumps((
+            " ".join(request.query.split()),
+            collection_name,
+            request.top_k,
+            request.similarity_threshold,
+            request.user_id,
+            request.group_id
+        ))).hexdigest()
+        results = await cache_get_json_async(cache_key)
+        
+        if results is None:
+            # 使用向量服务进行搜索（复用模块级服务实例，首次搜索时自动连接Milvus）
+            # 生成查询向量
+            query_embedding = await _get_query_embedding(request.query)
+            
+            # 执行向量搜索
+            results = await vector_service.search_vectors_async(
+                collection_name=collection_name,
+                query_embedding=query_embedding,
+                top_k=request.top_k,
+                similarity_threshold=request.similarity_threshold,
+                user_id=request.user_id,
+                group_id=request.group_id
+            )
+            # 空结果不缓存，新文档入库后可立即被检索到
+            if results:
+                await cache_set_json_async(cache_key, results, SEARCH_CACHE_TTL)
         
         return BaseResponse(
             success=True,
@@ -597,13 +1188,13 @@ async def query_knowledge_base(
         )
         
     except Exception as e:
-        logger.error(f"查询失败: {e}")
+        logger.error("查询失败: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/document/delete", response_model=BaseResponse)
 async def delete_document(
     request: DocumentDeleteRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除文档（软删除数据库记录，真实删除Milvus向量数据）"""
     try:
@@ -611,11 +1202,7 @@ async def delete_document(
         user_id = request.user_id or settings.default_user_id
         
         # 查找文档记录
-        document_task = db.query(KbDocument).filter(
-            KbDocument.doc_id == request.doc_id,
-            KbDocument.user_id == user_id,
-            KbDocument.is_active == True
-        ).first()
+        document_task = await _get_active_document(db, request.doc_id, user_id)
         
         if not document_task:
             return BaseResponse(
@@ -626,7 +1213,7 @@ async def delete_document(
         
         # 软删除数据库记录
         document_task.is_active = False
-        db.commit()
+        await db.commit()
         
         # 真实删除Milvus向量数据
         try:
@@ -637,9 +1224,9 @@ async def delete_document(
             )
             
             if not delete_result:
-                logger.warning(f"Milvus向量删除失败，但数据库记录已软删除: doc_id={document_task.doc_id}")
+                logger.warning("Milvus向量删除失败，但数据库记录已软删除: doc_id=%s", document_task.doc_id)
         except Exception as e:
-            logger.error(f"删除Milvus向量时出错: {e}")
+            logger.error("删除Milvus向量时出错: %s", e)
             # 即使Milvus删除失败，也不回滚数据库操作
         
         return BaseResponse(
@@ -648,13 +1235,13 @@ async def delete_document(
             data={
                 "doc_id": document_task.doc_id,
                 "doc_name": document_task.doc_name,
-                "deleted_at": document_task.updated_at.strftime("%Y-%m-%d %H:%M:%S")
+                "deleted_at": format_datetime(document_task.updated_at)
             }
         )
         
     except Exception as e:
-        logger.error(f"删除文档失败: {e}")
-        db.rollback()
+        logger.error("删除文档失败: %s", e)
+        await db.rollback()
         return BaseResponse(
             success=False,
             message="删除文档失败",
@@ -664,28 +1251,20 @@ async def delete_document(
 # ===== 文档上传接口 =====
 @router.post("/search", response_model=BaseResponse)
 async def search_knowledge_base(
-    request: KnowledgeSearchRequest,
-    db: Session = Depends(get_db)
+    request: KnowledgeSearchRequest
 ):
     """搜索知识库"""
     try:
-        results = await search_service.knowledge_search(
-            query=request.query,
-            top_k=request.top_k,
-            similarity_threshold=request.similarity_threshold,
-            collection_name=request.collection_name,
-            group_id=request.group_id,
-            user_id=request.user_id
-        )
-        return BaseResponse(
-            success=True,
-            message="搜索成功",
-            data={
+        results = await _search_knowledge_once(request)
+        return ORJSONResponse({
+            "success": True,
+            "message": "搜索成功",
+            "data": {
                 "query": request.query,
                 "results": results,
                 "total": len(results)
             }
-        )
+        })
     except Exception as e:
-        logger.error(f"搜索失败: {e}")
+        logger.error("搜索失败: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,16 +1,20 @@
 """系统API路由"""
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Awaitable, Callable, Dict, Tuple
+import asyncio
 import time
+import orjson
 import psutil
 import logging
 
-from core.database import get_db
+from core.database import get_async_db
 from core import db_manager
 from core.config import settings
 from models.schemas import BaseResponse, SystemStatus, ModelConfig, KnowledgeBaseConfig, SearchConfig
-from models.database import ChatSession
+from models.database import ChatSession, KbDocument
+from models.enums import TaskStatus
 from services.vector_service import VectorService
 
 router = APIRouter()
@@ -19,55 +23,108 @@ logger = logging.getLogger(__name__)
 # 应用启动时间
 start_time = time.time()
 
+# 状态检查复用的向量服务实例，连接建立一次后不再每次请求重新连接
+vector_service = VectorService()
+
+# 状态/统计接口的结果缓存时间（秒），同一时间窗内的轮询共享一次实际检查
+STATUS_CACHE_TTL = settings.status_cache_ttl
+# 缓存的结果：键 -> (生成时的单调时钟, 结果)
+_status_cache: Dict[str, Tuple[float, Any]] = {}
+# 每个键一把锁，缓存过期时只有一个请求执行检查，其余请求等待后复用其结果
+_status_locks: Dict[str, asyncio.Lock] = {"status": asyncio.Lock(), "stats": asyncio.Lock()}
+
+async def _get_cached(key: str, build: Callable[[], Awaitable[Any]]) -> Any:
+    """读取短时缓存的结果，过期时调用build重新生成"""
+    cached = _status_cache.get(key)
+    if cached and time.monotonic() - cached[0] < STATUS_CACHE_TTL:
+        return cached[1]
+    async with _status_locks[key]:
+        # 等锁期间可能已由其他请求刷新
+        cached = _status_cache.get(key)
+        if cached and time.monotonic() - cached[0] < STATUS_CACHE_TTL:
+            return cached[1]
+        payload = await build()
+        _status_cache[key] = (time.monotonic(), payload)
+        return payload
+
+# CPU使用率的最短采样间隔（秒），间隔内的请求直接复用上次的采样值
+CPU_SAMPLE_INTERVAL = 0.5
+# 磁盘使用情况变化缓慢，采样结果的复用时间（秒）
+DISK_SAMPLE_INTERVAL = 5.0
+# 资源采样缓存：名称 -> (采样时的单调时钟, 采样值)
+_resource_samples: Dict[str, Tuple[float, Any]] = {}
+
+# 以非阻塞方式记录CPU时间基准，之后的采样返回距上次采样期间的平均使用率
+psutil.cpu_percent(interval=None)
+
+def _sample_resource(name: str, interval: float, sampler: Callable[[], Any]) -> Any:
+    """按最短间隔采样系统资源，间隔内直接返回缓存值"""
+    cached = _resource_samples.get(name)
+    now = time.monotonic()
+    if cached and now - cached[0] < interval:
+        return cached[1]
+    value = sampler()
+    _resource_samples[name] = (now, value)
+    return value
+
+def _health_status(result) -> str:
+    """将检查结果（布尔值或异常）映射为组件状态"""
+    if isinstance(result, Exception):
+        logger.warning(f"组件状态检查失败: {result}")
+        return "unhealthy"
+    return "healthy" if result else "unhealthy"
+
+async def _collect_system_status(db: AsyncSession) -> SystemStatus:
+    """检查各组件并汇总系统状态"""
+    # 计算运行时间
+    uptime = time.time() - start_time
+    
+    # 各组件检查与会话统计并发执行，耗时取决于最慢的一项而不是各项之和
+    # MySQL与Redis的检查是同步调用，放到线程中执行
+    mysql_result, redis_result, milvus_result, active_sessions = await asyncio.gather(
+        asyncio.to_thread(db_manager.test_connection),
+        asyncio.to_thread(db_manager.test_redis_connection),
+        vector_service.test_connection(),
+        db.scalar(select(func.count()).select_from(ChatSession).where(ChatSession.is_active == True)),
+        return_exceptions=True
+    )
+    if isinstance(active_sessions, Exception):
+        raise active_sessions
+    
+    database_status = _health_status(mysql_result)
+    redis_status = _health_status(redis_result)
+    milvus_status = _health_status(milvus_result)
+    
+    # Celery状态检查（简化）
+    celery_status = "unknown"  # 实际项目中需要实现Celery状态检查
+    
+    total_documents = 0  # db.query(KbDocument).count()
+    total_chunks = 0  # db.query(DocumentChunk).count()
+    
+    # 整体状态
+    overall_status = "healthy" if all([
+        database_status == "healthy",
+        redis_status == "healthy"
+    ]) else "unhealthy"
+    
+    return SystemStatus(
+        status=overall_status,
+        version="1.0.0",
+        uptime=uptime,
+        database_status=database_status,
+        redis_status=redis_status,
+        milvus_status=milvus_status,
+        celery_status=celery_status,
+        active_sessions=active_sessions,
+        total_documents=total_documents,
+        total_chunks=total_chunks
+    )
+
 @router.get("/status", response_model=BaseResponse)
-async def get_system_status(db: Session = Depends(get_db)):
-    """获取系统状态"""
+async def get_system_status(db: AsyncSession = Depends(get_async_db)):
+    """获取系统状态（结果短时缓存，频繁轮询不会重复检查各组件）"""
     try:
-        # 计算运行时间
-        uptime = time.time() - start_time
-        
-        # 检查各组件状态
-        database_status = "healthy" if db_manager.test_connection() else "unhealthy"
-        redis_status = "healthy" if db_manager.test_redis_connection() else "unhealthy"
-        
-        # Milvus状态检查
-        vector_service = VectorService()
-        try:
-            milvus_status = "healthy" if await vector_service.test_connection() else "unhealthy"
-        except Exception as e:
-            logger.warning(f"Milvus状态检查失败: {e}")
-            milvus_status = "unhealthy"
-        
-        # Celery状态检查（简化）
-        celery_status = "unknown"  # 实际项目中需要实现Celery状态检查
-        
-        # 统计信息
-        active_sessions = db.query(ChatSession).filter(
-            ChatSession.is_active == True
-        ).count()
-        
-        total_documents = 0  # db.query(KbDocument).count()
-        total_chunks = 0  # db.query(DocumentChunk).count()
-        
-        # 整体状态
-        overall_status = "healthy" if all([
-            database_status == "healthy",
-            redis_status == "healthy"
-        ]) else "unhealthy"
-        
-        status_data = SystemStatus(
-            status=overall_status,
-            version="1.0.0",
-            uptime=uptime,
-            database_status=database_status,
-            redis_status=redis_status,
-            milvus_status=milvus_status,
-            celery_status=celery_status,
-            active_sessions=active_sessions,
-            total_documents=total_documents,
-            total_chunks=total_chunks
-        )
-        
+        status_data = await _get_cached("status", lambda: _collect_system_status(db))
         return BaseResponse(
             success=True,
             message="系统状态获取成功",
@@ -82,9 +139,10 @@ async def get_system_info():
     """获取系统信息"""
     try:
         # 系统资源信息
-        cpu_percent = psutil.cpu_percent(interval=1)
+        # CPU使用率取非阻塞采样（不再在请求中等待1秒），磁盘使用情况短时复用
+        cpu_percent = _sample_resource("cpu", CPU_SAMPLE_INTERVAL, lambda: psutil.cpu_percent(interval=None))
         memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
+        disk = _sample_resource("disk", DISK_SAMPLE_INTERVAL, lambda: psutil.disk_usage('/'))
         
         system_info = {
             "version": "1.0.0",
@@ -122,114 +180,107 @@ async def get_system_info():
         logger.error(f"获取系统信息失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _frozen_response(message: str, data: Any) -> bytes:
+    """预先序列化只读接口的完整响应体"""
+    return orjson.dumps(BaseResponse(success=True, message=message, data=data).model_dump())
+
+# 配置在运行期间不变，模块加载时构建并序列化一次，请求直接返回字节内容
+MODEL_CONFIG_RESPONSE = _frozen_response("模型配置获取成功", ModelConfig(
+    chat_model=settings.chat_model,
+    embedding_model=settings.embedding_model,
+    rerank_model=settings.rerank_model,
+    max_tokens=settings.max_tokens,
+    temperature=settings.temperature,
+    top_p=0.9  # 从配置文件读取
+))
+
+KNOWLEDGE_BASE_CONFIG_RESPONSE = _frozen_response("知识库配置获取成功", KnowledgeBaseConfig(
+    chunk_size=settings.chunk_size,
+    chunk_overlap=50,  # 从配置文件读取
+    top_k=settings.top_k,
+    similarity_threshold=settings.similarity_threshold,
+    rerank_top_k=5  # 从配置文件读取
+))
+
+SEARCH_CONFIG_RESPONSE = _frozen_response("搜索配置获取成功", SearchConfig(
+    web_search_enabled=settings.web_search_enabled,
+    web_search_timeout=10,  # 从配置文件读取
+    max_search_results=5,  # 从配置文件读取
+    knowledge_confidence_threshold=settings.knowledge_confidence_threshold,
+    use_web_fallback=True  # 从配置文件读取
+))
+
 @router.get("/config/models", response_model=BaseResponse)
 async def get_model_config():
     """获取模型配置"""
-    try:
-        config = ModelConfig(
-            chat_model=settings.chat_model,
-            embedding_model=settings.embedding_model,
-            rerank_model=settings.rerank_model,
-            max_tokens=settings.max_tokens,
-            temperature=settings.temperature,
-            top_p=0.9  # 从配置文件读取
-        )
-        
-        return BaseResponse(
-            success=True,
-            message="模型配置获取成功",
-            data=config
-        )
-    except Exception as e:
-        logger.error(f"获取模型配置失败: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=MODEL_CONFIG_RESPONSE, media_type="application/json")
 
 @router.get("/config/knowledge_base", response_model=BaseResponse)
 async def get_knowledge_base_config():
     """获取知识库配置"""
-    try:
-        config = KnowledgeBaseConfig(
-            chunk_size=settings.chunk_size,
-            chunk_overlap=50,  # 从配置文件读取
-            top_k=settings.top_k,
-            similarity_threshold=settings.similarity_threshold,
-            rerank_top_k=5  # 从配置文件读取
-        )
-        
-        return BaseResponse(
-            success=True,
-            message="知识库配置获取成功",
-            data=config
-        )
-    except Exception as e:
-        logger.error(f"获取知识库配置失败: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=KNOWLEDGE_BASE_CONFIG_RESPONSE, media_type="application/json")
 
 @router.get("/config/search", response_model=BaseResponse)
 async def get_search_config():
     """获取搜索配置"""
-    try:
-        config = SearchConfig(
-            web_search_enabled=settings.web_search_enabled,
-            web_search_timeout=10,  # 从配置文件读取
-            max_search_results=5,  # 从配置文件读取
-            knowledge_confidence_threshold=settings.knowledge_confidence_threshold,
-            use_web_fallback=True  # 从配置文件读取
-        )
-        
-        return BaseResponse(
-            success=True,
-            message="搜索配置获取成功",
-            data=config
-        )
-    except Exception as e:
-        logger.error(f"获取搜索配置失败: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=SEARCH_CONFIG_RESPONSE, media_type="application/json")
+
+async def _collect_system_stats(db: AsyncSession) -> Dict[str, Any]:
+    """汇总系统统计信息"""
+    # 会话统计：条件聚合，一次查询同时得到总数与活跃数
+    total_sessions, active_sessions = (await db.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(case((ChatSession.is_active == True, 1), else_=0)), 0)
+        ).select_from(ChatSession)
+    )).one()
+    
+    # 文档统计：按状态分组一次查询，在Python中汇总（不含已删除的文档）
+    status_rows = (await db.execute(
+        select(
+            KbDocument.status,
+            func.count(),
+            func.coalesce(func.sum(KbDocument.total_chunks), 0)
+        ).where(KbDocument.is_active == True).group_by(KbDocument.status)
+    )).all()
+    doc_stats = {status.value: 0 for status in TaskStatus}
+    total_chunks = 0
+    for status, count, chunks in status_rows:
+        doc_stats[status.value] = count
+        total_chunks += int(chunks)
+    total_documents = sum(doc_stats.values())
+    processed_documents = doc_stats[TaskStatus.COMPLETED.value]
+    
+    stats = {
+        "sessions": {
+            "total": total_sessions,
+            "active": active_sessions,
+            "inactive": total_sessions - active_sessions
+        },
+        "documents": {
+            "total": total_documents,
+            "processed": processed_documents,
+            "processing_rate": (processed_documents / total_documents * 100) if total_documents > 0 else 0,
+            "by_status": doc_stats
+        },
+        "chunks": {
+            "total": total_chunks,
+            "average_per_document": total_chunks / total_documents if total_documents > 0 else 0
+        },
+        "system": {
+            "uptime": time.time() - start_time,
+            "requests_handled": "N/A",  # 需要实现请求计数器
+            "average_response_time": "N/A"  # 需要实现响应时间统计
+        }
+    }
+    
+    return stats
 
 @router.get("/stats", response_model=BaseResponse)
-async def get_system_stats(db: Session = Depends(get_db)):
-    """获取系统统计信息"""
+async def get_system_stats(db: AsyncSession = Depends(get_async_db)):
+    """获取系统统计信息（结果短时缓存，频繁轮询不会重复统计）"""
     try:
-        # 数据库统计
-        total_sessions = db.query(ChatSession).count()
-        active_sessions = db.query(ChatSession).filter(
-            ChatSession.is_active == True
-        ).count()
-        
-        total_documents = 0  # db.query(KbDocument).count()
-        processed_documents = 0  # db.query(KbDocument).filter(KbDocument.status == "completed").count()
-        
-        total_chunks = 0  # db.query(DocumentChunk).count()
-        
-        # 按状态统计文档
-        doc_stats = {}
-        for status in ["pending", "processing", "completed", "failed"]:
-            count = 0  # db.query(KbDocument).filter(KbDocument.status == status).count()
-            doc_stats[status] = count
-        
-        stats = {
-            "sessions": {
-                "total": total_sessions,
-                "active": active_sessions,
-                "inactive": total_sessions - active_sessions
-            },
-            "documents": {
-                "total": total_documents,
-                "processed": processed_documents,
-                "processing_rate": (processed_documents / total_documents * 100) if total_documents > 0 else 0,
-                "by_status": doc_stats
-            },
-            "chunks": {
-                "total": total_chunks,
-                "average_per_document": total_chunks / total_documents if total_documents > 0 else 0
-            },
-            "system": {
-                "uptime": time.time() - start_time,
-                "requests_handled": "N/A",  # 需要实现请求计数器
-                "average_response_time": "N/A"  # 需要实现响应时间统计
-            }
-        }
-        
+        stats = await _get_cached("stats", lambda: _collect_system_stats(db))
         return BaseResponse(
             success=True,
             message="系统统计信息获取成功",
@@ -2,4 +2,5 @@ from .database import DatabaseManager
 # 全局数据库管理器实例
 db_manager = DatabaseManager()
 # 全局共享状态，用于追踪和取消活动的流式请求
+# 结构: {request_id: {"event": asyncio.Event}}，event被set表示请求已被取消
 active_streams = {}
@@ -1,19 +1,38 @@
 """配置管理模块"""
 import os
+import json
 import configparser
+import logging
+from functools import cached_property
 from typing import List
 from dotenv import load_dotenv
 from datetime import datetime
 # 加载环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# 配置文件路径与解析结果在模块导入时计算一次，所有Settings实例共享同一份只读配置
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'conf.ini')
+
+def _load_config() -> configparser.ConfigParser:
+    """读取并解析配置文件"""
+    # 允许值后跟行内注释（如 max_file_size = 10  # 单位：MB）
+    config = configparser.ConfigParser(inline_comment_prefixes=('#',))
+    config.read(CONFIG_PATH, encoding='utf-8')
+    return config
+
+_CONFIG = _load_config()
+
 class Settings:
-    """应用配置类"""
+    """应用配置类
+    
+    配置在进程运行期间不变，各配置项首次读取后缓存为实例属性，之后的访问不再解析配置文件、拼接URL；
+    base_prompt 包含当前时间，保持每次生成。
+    """
     
     def __init__(self):
-        self.config = configparser.ConfigParser()
-        config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'config', 'conf.ini')
-        self.config.read(config_path, encoding='utf-8')
+        self.config = _CONFIG
     
     # SiliconFlow配置
     SILICONFLOW_API_KEY: str = os.getenv("SILICONFLOW_API_KEY", "")
@@ -42,6 +61,8 @@ class Settings:
     REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
     REDIS_PASSWORD: str = os.getenv("REDIS_PASSWORD", "")
     REDIS_CHAT_MEMORY_DB: int = int(os.getenv("REDIS_CHAT_MEMORY_DB", "0"))
+    # Redis连接与读写超时（秒），Redis不可用时快速失败而不是无限等待
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
     
     MILVUS_HOST: str = os.getenv("MILVUS_HOST", "localhost")
     MILVUS_PORT: int = int(os.getenv("MILVUS_PORT", "19530"))
@@ -58,145 +79,199 @@ class Settings:
     CELERY_BROKER_DB: int = int(os.getenv("CELERY_BROKER_DB", "1"))
     CELERY_RESULT_DB: int = int(os.getenv("CELERY_RESULT_DB", "2"))
     
-    @property
+    @cached_property
     def chat_model(self) -> str:
         """获取对话模型名称"""
         return self.config.get('models', 'chat_model', fallback='deepseek-ai/DeepSeek-R1')
     
-    @property
+    @cached_property
     def embedding_model(self) -> str:
         """获取嵌入模型名称"""
         return self.config.get('models', 'embedding_model', fallback='BAAI/bge-large-zh-v1.5')
     
-    @property
+    @cached_property
     def rerank_model(self) -> str:
         """获取重排序模型名称"""
         return self.config.get('models', 'rerank_model', fallback='BAAI/bge-reranker-v2-m3')
     
-    @property
+    @cached_property
     def max_tokens(self) -> int:
         """获取最大token数"""
         return self.config.getint('models', 'max_tokens', fallback=4096)
     
-    @property
+    @cached_property
     def temperature(self) -> float:
         """获取温度参数"""
         return self.config.getfloat('models', 'temperature', fallback=0.7)
     
-    @property
+    @cached_property
     def chunk_size(self) -> int:
         """获取文档分块大小"""
         return self.config.getint('embedding', 'chunk_size', fallback=512)
     
-    @property
+    @cached_property
     def chunk_overlap(self) -> int:
         """获取文档分块重叠大小"""
         return self.config.getint('embedding', 'chunk_overlap', fallback=50)
     
-    @property
+    @cached_property
     def top_k(self) -> int:
         """获取检索top_k"""
         return self.config.getint('knowledge_base', 'top_k', fallback=10)
     
-    @property
+    @cached_property
     def similarity_threshold(self) -> float:
         """获取相似度阈值"""
         return self.config.getfloat('knowledge_base', 'similarity_threshold', fallback=0.5)
     
-    @property
+    @cached_property
     def web_search_enabled(self) -> bool:
         """是否启用联网搜索"""
         return self.config.getboolean('search', 'web_search_enabled', fallback=True)
     
-    @property
+    @cached_property
     def knowledge_confidence_threshold(self) -> float:
         """知识库置信度阈值"""
         return self.config.getfloat('search', 'knowledge_confidence_threshold', fallback=0.5)
     
-    @property
+    @cached_property
+    def status_cache_ttl(self) -> float:
+        """获取系统状态/统计接口的结果缓存时间（秒）"""
+        return self.config.getfloat('api', 'status_cache_ttl', fallback=2.0)
+    
+    @cached_property
     def cors_origins(self) -> List[str]:
         """获取CORS允许的源"""
         origins_str = self.config.get('api', 'cors_origins', fallback='["*"]')
-        # 简单解析，实际项目中可能需要更复杂的解析
-        return ["*"] if origins_str == '["*"]' else origins_str.strip('[]').replace('"', '').split(',')
-    
-    @property
+        # 配置值为JSON字符串数组，单个字符串视为只有一个源；配置有误时不放行任何跨域请求
+        try:
+            origins = json.loads(origins_str)
+        except json.JSONDecodeError as e:
+            logger.error(f"CORS源配置不是合法的JSON，已禁用跨域访问: {e}")
+            return []
+        if isinstance(origins, str):
+            origins = [origins]
+        if not isinstance(origins, list) or not all(isinstance(origin, str) for origin in origins):
+            logger.error(f"CORS源配置必须是字符串数组，已禁用跨域访问: {origins_str}")
+            return []
+        return origins
+    
+    @cached_property
     def database_url(self) -> str:
         """获取数据库连接URL"""
         return f"mysql+pymysql://{self.MYSQL_USER}:{self.MYSQL_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DATABASE}"
     
-    @property
+    @cached_property
+    def async_database_url(self) -> str:
+        """获取异步数据库连接URL（aiomysql驱动）"""
+        return f"mysql+aiomysql://{self.MYSQL_USER}:{self.MYSQL_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DATABASE}"
+    
+    @cached_property
+    def mysql_pool_size(self) -> int:
+        """获取数据库连接池常驻连接数"""
+        return self.config.getint('database', 'mysql_pool_size', fallback=10)
+    
+    @cached_property
+    def mysql_max_overflow(self) -> int:
+        """获取数据库连接池允许超出常驻数的额外连接数"""
+        return self.config.getint('database', 'mysql_max_overflow', fallback=20)
+    
+    @cached_property
+    def mysql_pool_timeout(self) -> int:
+        """获取从连接池获取连接的等待超时（秒）"""
+        return self.config.getint('database', 'mysql_pool_timeout', fallback=30)
+    
+    @cached_property
+    def mysql_pool_recycle(self) -> int:
+        """获取连接回收时间（秒）"""
+        return self.config.getint('database', 'mysql_pool_recycle', fallback=3600)
+    
+    @cached_property
     def redis_url(self) -> str:
         """获取Redis连接URL（用于聊天记忆缓存）"""
         if self.REDIS_PASSWORD:
             return f"redis://:{self.REDIS_PASSWORD}@{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_CHAT_MEMORY_DB}"
         return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_CHAT_MEMORY_DB}"
     
-    @property
+    @cached_property
     def celery_broker_url(self) -> str:
         """获取Celery Broker连接URL"""
         if self.REDIS_PASSWORD:
             return f"redis://:{self.REDIS_PASSWORD}@{self.REDIS_HOST}:{self.REDIS_PORT}/{self.CELERY_BROKER_DB}"
         return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}/{self.CELERY_BROKER_DB}"
     
-    @property
+    @cached_property
     def celery_result_backend(self) -> str:
         """获取Celery Result Backend连接URL"""
         if self.REDIS_PASSWORD:
             return f"redis://:{self.REDIS_PASSWORD}@{self.REDIS_HOST}:{self.REDIS_PORT}/{self.CELERY_RESULT_DB}"
         return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}/{self.CELERY_RESULT_DB}"
     
-    @property
+    @cached_property
+    def outbox_poll_interval(self) -> float:
+        """获取任务发件箱的轮询间隔（秒），新任务写入后会立即唤醒，轮询仅用于兜底"""
+        return self.config.getfloat('celery', 'outbox_poll_interval', fallback=1.0)
+    
+    @cached_property
+    def outbox_batch_size(self) -> int:
+        """获取任务发件箱每批投递的任务数量上限"""
+        return self.config.getint('celery', 'outbox_batch_size', fallback=100)
+    
+    @cached_property
     def default_username(self) -> str:
         """获取默认用户名"""
         return self.config.get('default_user', 'username', fallback='admin')
     
-    @property
+    @cached_property
     def default_email(self) -> str:
         """获取默认用户邮箱"""
         return self.config.get('default_user', 'email', fallback='admin@sparklinkai.com')
     
-    @property
+    @cached_property
     def default_user_active(self) -> bool:
         """获取默认用户激活状态"""
         return self.config.getboolean('default_user', 'is_active', fallback=True)
     
-    @property
+    @cached_property
     def default_user_id(self) -> str:
         """获取默认用户ID"""
         return self.config.get('default_user', 'id', fallback='admin123456789abcdef0123456789ab')
     
-    @property
+    @cached_property
     def default_kb_group_id(self) -> str:
         """获取默认知识库分组ID"""
         return self.config.get('default_kb_group', 'id', fallback='default_kb_group_123456789abcdef')
     
-    @property
+    @cached_property
     def default_kb_group_name(self) -> str:
         """获取默认知识库分组名称"""
         return self.config.get('default_kb_group', 'name', fallback='默认知识库')
     
-    @property
+    @cached_property
     def default_kb_group_description(self) -> str:
         """获取默认知识库分组描述"""
         return self.config.get('default_kb_group', 'description', fallback='系统自动创建的默认知识库分组')
     
-    @property
+    @cached_property
     def upload_dir(self) -> str:
         """获取文件上传目录"""
         return self.config.get('upload', 'upload_dir', fallback='uploads')
     
-    @property
+    @cached_property
     def max_file_size(self) -> int:
-        """获取最大文件上传大小（字节）"""
-        return self.config.getint('upload', 'max_file_size', fallback=10485760)  # 默认10MB
+        """获取最大文件上传大小（MB）"""
+        return self.config.getint('upload', 'max_file_size', fallback=10)
     
-    @property
+    @cached_property
+    def upload_concurrency(self) -> int:
+        """获取同时写入磁盘的上传文件数量上限"""
+        return self.config.getint('upload', 'upload_concurrency', fallback=4)
+    
+    @cached_property
     def allowed_file_types(self) -> List[str]:
         """获取允许的文件类型"""
         types_str = self.config.get('upload', 'allowed_file_types', fallback='["pdf", "doc", "docx", "ppt", "pptx", "txt", "md", "jpg", "png", "gif"]')
         # 简单解析配置文件中的列表格式
-        import json
         try:
             return json.loads(types_str.replace("'", '"'))
         except:
@@ -225,33 +300,33 @@ class Settings:
 - 能力范围：目标将以“平台化、智能化、国际化”为导向，构建集内容展示、知识资料、开发者社区、技术论坛、智能问答、项目管理等功能于一体的综合社区门户
 """
         return base_prompt.strip()
-    @property
+    @cached_property
     def conversation_history_limit(self) -> int:
         """获取对话历史记录限制数量"""
         return self.config.getint('chat', 'conversation_history_limit', fallback=20)
     
     # 文档解析配置
-    @property
+    @cached_property
     def parser_type(self) -> str:
         """获取文档解析器类型"""
         return self.config.get('document_parser', 'PARSER_TYPE', fallback='mineru')
     
-    @property
+    @cached_property
     def textin_api_url(self) -> str:
         """获取 TextIn API URL"""
         return self.TEXTIN_API_URL
     
-    @property
+    @cached_property
     def mineru_api_url(self) -> str:
         """获取 MinerU API URL"""
         return self.MINERU_API_URL
     
-    @property
+    @cached_property
     def mineru_api_key(self) -> str:
         """获取 MinerU API Key"""
         return self.MINERU_API_KEY
     
-    @property
+    @cached_property
     def rerank_top_k(self) -> int:
         """获取重排序返回的文档数量"""
         return self.config.getint('knowledge_base', 'rerank_top_k', fallback=5)
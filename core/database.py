@@ -1,29 +1,62 @@
 """数据库连接管理"""
 import redis
+import redis.asyncio as aioredis
 from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from core.config import settings
 from models.database import Base
 # MySQL数据库引擎
 engine = create_engine(
     settings.database_url,
+    pool_size=settings.mysql_pool_size,
+    max_overflow=settings.mysql_max_overflow,
+    pool_timeout=settings.mysql_pool_timeout,
     pool_pre_ping=True,
-    pool_recycle=3600,
+    pool_recycle=settings.mysql_pool_recycle,
     echo=settings.APP_DEBUG
 )
 
 # 会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步MySQL数据库引擎（用于异步路由，避免数据库I/O阻塞事件循环）
+# 异步路由的并发查询数受连接池大小限制，按配置设置而非使用默认的5个常驻连接
+async_engine = create_async_engine(
+    settings.async_database_url,
+    pool_size=settings.mysql_pool_size,
+    max_overflow=settings.mysql_max_overflow,
+    pool_timeout=settings.mysql_pool_timeout,
+    pool_pre_ping=True,
+    pool_recycle=settings.mysql_pool_recycle,
+    echo=settings.APP_DEBUG
+)
+
+# 异步会话工厂（提交后不过期对象，避免访问属性时隐式触发同步加载）
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Redis连接（用于聊天记忆缓存）
 redis_client = redis.Redis(
     host=settings.REDIS_HOST,
     port=settings.REDIS_PORT,
     password=settings.REDIS_PASSWORD if settings.REDIS_PASSWORD else None,
     db=settings.REDIS_CHAT_MEMORY_DB,
-    decode_responses=True
+    decode_responses=True,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT
+)
+
+# 异步Redis连接（用于异步路由，避免Redis往返阻塞事件循环）
+async_redis_client = aioredis.Redis(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    password=settings.REDIS_PASSWORD if settings.REDIS_PASSWORD else None,
+    db=settings.REDIS_CHAT_MEMORY_DB,
+    decode_responses=True,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT
 )
 
 def create_tables():
@@ -38,10 +71,19 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """获取异步数据库会话"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def get_redis() -> redis.Redis:
     """获取Redis连接"""
     return redis_client
 
+def get_async_redis() -> aioredis.Redis:
+    """获取异步Redis连接"""
+    return async_redis_client
+
 class DatabaseManager:
     """数据库管理器"""
     
@@ -53,6 +95,16 @@ class DatabaseManager:
     def create_tables(self):
         """创建所有表"""
         Base.metadata.create_all(bind=self.engine)
+        self.ensure_indexes()
+    
+    def ensure_indexes(self):
+        """补建模型中新增的索引
+        
+        create_all不会为已存在的表添加索引，这里逐个检查并创建缺失的索引。
+        """
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=self.engine, checkfirst=True)
     
     def drop_tables(self):
         """删除所有表"""
@@ -43,21 +43,32 @@ def delete_all_remaining_tables():
     engine = create_engine(settings.database_url, echo=True)
     inspector = inspect(engine)
     
+    # 获取记录数：所有表的精确计数合并为一条UNION ALL查询，只需一个连接、一次往返
+    row_counts = {}
+    count_error = None
+    try:
+        count_sql = " UNION ALL ".join(
+            f"SELECT :name_{i} AS table_name, COUNT(*) AS row_count FROM `{table_name}`"
+            for i, table_name in enumerate(table_names)
+        )
+        params = {f"name_{i}": table_name for i, table_name in enumerate(table_names)}
+        with engine.connect() as conn:
+            row_counts = dict(conn.execute(text(count_sql), params).all())
+    except Exception as e:
+        count_error = e
+    
     # 显示每个表的详细信息
     for table_name in table_names:
         print(f"📋 表: {table_name}")
         
-        # 获取记录数
-        try:
-            with engine.connect() as conn:
-                result = conn.execute(text(f"SELECT COUNT(*) FROM `{table_name}`"))
-                row_count = result.scalar()
-                print(f"   📊 记录数: {row_count}")
-                
-                if row_count > 0:
-                    print(f"   ⚠️  包含 {row_count} 条数据，删除后将无法恢复！")
-        except Exception as e:
-            print(f"   ❌ 无法获取记录数: {e}")
+        if count_error is not None:
+            print(f"   ❌ 无法获取记录数: {count_error}")
+        else:
+            row_count = row_counts.get(table_name, 0)
+            print(f"   📊 记录数: {row_count}")
+            
+            if row_count > 0:
+                print(f"   ⚠️  包含 {row_count} 条数据，删除后将无法恢复！")
         
         print()
     
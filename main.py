@@ -1,18 +1,21 @@
 """FastAPI主应用"""
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import ORJSONResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+import os
 import time
 import logging
 from contextlib import asynccontextmanager
 from core.config import settings
 from core import db_manager
+from core.database import async_engine
 from api import chat, knowledge_base, system
 from models.schemas import BaseResponse
 from utils.user_utils import create_default_user, ensure_default_kb_groups
-from services.vector_service import VectorService
+from services.chat_service import close_llm_client, close_stream_listener
+from services.outbox_service import outbox_service
 
 # 配置日志
 logging.basicConfig(
@@ -56,27 +59,39 @@ async def lifespan(app: FastAPI):
         logger.error(f"默认知识库分组创建失败: {e}")
     # 创建上传目录
     try:
-        import os
         upload_dir = settings.upload_dir
         os.makedirs(upload_dir, exist_ok=True)
         logger.info(f"上传目录创建/检查完成: {upload_dir}")
     except Exception as e:
         logger.error(f"上传目录创建失败: {e}")
     # 初始化 Milvus 集合
+    # 直接连接知识库路由复用的服务实例，首个查询请求无需再建立连接
     try:
-        vector_service = VectorService()
+        vector_service = knowledge_base.vector_service
         if await vector_service.connect():
+            await knowledge_base.search_service.vector_service.connect()
             await vector_service.create_collection(settings.MILVUS_COLLECTION_NAME)
             logger.info(f"Milvus集合初始化完成: {settings.MILVUS_COLLECTION_NAME}")
         else:
             logger.warning("Milvus 未连接，向量相关功能不可用")
     except Exception as e:
         logger.error(f"Milvus 初始化失败: {e}")
+    # 启动任务发件箱投递器，继续投递上次退出前未发送的任务
+    outbox_service.start()
     logger.info("SparkLink AI 应用启动完成")
     yield
     
     # 关闭时执行
     logger.info("正在关闭 SparkLink AI 应用...")
+    await outbox_service.stop()
+    await close_stream_listener()
+    # 关闭共享的大模型客户端连接池
+    try:
+        await close_llm_client()
+    except Exception as e:
+        logger.error(f"关闭大模型客户端失败: {e}")
+    # 释放异步数据库连接池
+    await async_engine.dispose()
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -85,6 +100,8 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    # 默认使用orjson序列化响应，列表类接口的JSON编码开销更低
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -115,13 +132,13 @@ async def add_process_time_header(request: Request, call_next):
 async def global_exception_handler(request: Request, exc: Exception):
     """全局异常处理器"""
     logger.error(f"全局异常: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content=BaseResponse(
             success=False,
             message=f"服务器内部错误: {str(exc)}",
             data=None
-        ).dict()
+        ).model_dump()
     )
 
 # 挂载静态文件
@@ -190,5 +207,7 @@ if __name__ == "__main__":
         host=settings.APP_HOST,
         port=settings.APP_PORT,
         reload=settings.APP_DEBUG,
+        # uvloop由uvicorn[standard]提供，降低流式响应每次yield的事件循环开销
+        loop="uvloop",
         log_level="info"
     )
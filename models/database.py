@@ -2,7 +2,7 @@
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 import uuid
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import pytz
@@ -47,6 +47,11 @@ class ChatSession(Base):
     # 关系
     user = relationship("User", back_populates="sessions")
     messages = relationship("ChatMessage", back_populates="session")
+    
+    # 复合索引：按用户与更新时间游标分页查询会话列表
+    __table_args__ = (
+        Index("ix_session_user_updated", "user_id", "updated_at", "id"),
+    )
 
 class ChatMessage(Base):
     """聊天消息模型"""
@@ -69,6 +74,11 @@ class ChatMessage(Base):
     
     # 关系
     session = relationship("ChatSession", back_populates="messages")
+    
+    # 复合索引：按会话分页查询消息时直接按序号范围扫描，无需额外排序
+    __table_args__ = (
+        Index("ix_msg_session_seq", "session_id", "sequence_number"),
+    )
 
 class KbGroup(Base):
     """知识库分组表"""
@@ -82,9 +92,15 @@ class KbGroup(Base):
     updated_at = Column(DateTime, default=get_shanghai_time, onupdate=get_shanghai_time)
     is_active = Column(Boolean, default=True)
     
+    # 复合索引：按用户列出有效分组、按名称查重时直接索引定位
+    __table_args__ = (
+        Index("ix_kbgroup_user_active_name", "user_id", "is_active", "group_name"),
+    )
+    
     # 关系
     user = relationship("User", back_populates="kb_groups")
-    kb_documents = relationship("KbDocument", back_populates="kb_group")
+    # lazy="raise"：禁止隐式懒加载（异步会话中会失败），需要时显式使用selectinload等加载
+    kb_documents = relationship("KbDocument", back_populates="kb_group", lazy="raise")
 
 class KbDocument(Base):
     """文档嵌入处理任务表"""
@@ -109,6 +125,28 @@ class KbDocument(Base):
     started_at = Column(DateTime, nullable=True)  # 开始处理时间
     completed_at = Column(DateTime, nullable=True)  # 完成时间
     
+    # 复合索引：按分组列出/统计用户的有效文档，并按创建时间做游标分页（doc_id为主键、task_id已有单列索引，无需再建）
+    __table_args__ = (
+        Index("ix_kbdoc_group_user_active_created", "group_id", "user_id", "is_active", "created_at"),
+    )
+    
     # 关系
     user = relationship("User", back_populates="kb_documents")
-    kb_group = relationship("KbGroup", back_populates="kb_documents")
\ No newline at end of file
+    kb_group = relationship("KbGroup", back_populates="kb_documents", lazy="raise")
+
+class TaskOutbox(Base):
+    """任务发件箱表：与业务记录在同一事务中写入，由后台投递器发送到Celery"""
+    __tablename__ = "task_outbox"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String(64), nullable=False)  # 预先生成的Celery任务ID
+    task_name = Column(String(255), nullable=False)  # Celery任务名称
+    # JSON格式存储任务参数；POST内容随参数保存（最长50000字），指定长度使MySQL使用MEDIUMTEXT
+    payload = Column(Text(16 * 1024 * 1024 - 1), nullable=False)
+    created_at = Column(DateTime, default=get_shanghai_time)
+    dispatched_at = Column(DateTime, nullable=True)  # 投递时间，为空表示待投递
+    
+    # 复合索引：投递器按写入顺序扫描待投递记录
+    __table_args__ = (
+        Index("ix_outbox_dispatched_id", "dispatched_at", "id"),
+    )
\ No newline at end of file
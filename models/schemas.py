@@ -3,14 +3,15 @@ from datetime import datetime
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, Field
 import json
-from models.enums import DocType
+from models.enums import DocType, SearchStrategy
 from core.config import settings
+from utils.time_utils import format_datetime
 # 自定义JSON编码器，统一时间格式
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
             # 格式化为 YYYY-MM-DD HH:MM:SS，去掉T分隔符
-            return obj.strftime('%Y-%m-%d %H:%M:%S')
+            return format_datetime(obj)
         return super().default(obj)
 
 # 基础响应模型
@@ -37,7 +38,7 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
         json_encoders = {
-            datetime: lambda v: v.strftime('%Y-%m-%d %H:%M:%S')
+            datetime: format_datetime
         }
 
 # 聊天相关模型
@@ -47,7 +48,7 @@ class ChatRequest(BaseModel):
     user_id: str = Field(settings.default_user_id, description="用户ID")
     session_id: Optional[str] = Field(None, description="会话ID，如果为空则创建新会话")
     is_first: bool = Field(False, description="是否为新会话的第一条消息")
-    search_strategy: str = Field("auto", description="搜索策略")
+    search_strategy: SearchStrategy = Field(SearchStrategy.AUTO, description="搜索策略")
     max_tokens: int = Field(settings.max_tokens, ge=100, le=4000, description="最大回复长度")
     temperature: float = Field(settings.temperature, ge=0.0, le=1.0, description="创造性参数")
     search_top_k: int = Field(settings.top_k, ge=1, le=20, description="搜索结果数量")
@@ -67,7 +68,7 @@ class ChatMessage(BaseModel):
     class Config:
         from_attributes = True
         json_encoders = {
-            datetime: lambda v: v.strftime('%Y-%m-%d %H:%M:%S')
+            datetime: format_datetime
         }
 
 class ChatSessionCreate(BaseModel):
@@ -87,7 +88,7 @@ class ChatSessionResponse(BaseModel):
     class Config:
         from_attributes = True
         json_encoders = {
-            datetime: lambda v: v.strftime('%Y-%m-%d %H:%M:%S')
+            datetime: format_datetime
         }
 
 class ChatSessionDelete(BaseModel):
@@ -131,7 +132,7 @@ class DocumentGroupResponse(BaseModel):
     class Config:
         from_attributes = True
         json_encoders = {
-            datetime: lambda v: v.strftime('%Y-%m-%d %H:%M:%S')
+            datetime: format_datetime
         }
 
 class DocumentGroupUpdate(BaseModel):
@@ -208,7 +209,7 @@ class DocumentResponse(BaseModel):
     class Config:
         from_attributes = True
         json_encoders = {
-            datetime: lambda v: v.strftime('%Y-%m-%d %H:%M:%S')
+            datetime: format_datetime
         }
 
 class DocumentChunkResponse(BaseModel):
@@ -246,7 +247,7 @@ class KnowledgeBaseResponse(BaseModel):
     class Config:
         from_attributes = True
         json_encoders = {
-            datetime: lambda v: v.strftime('%Y-%m-%d %H:%M:%S')
+            datetime: format_datetime
         }
 
 # 获取知识库分组列表请求模型
@@ -267,6 +268,8 @@ class GroupDetailRequest(BaseModel):
     """获取知识库分组详情请求模型"""
     group_id: str = Field(..., description="分组ID")
     user_id: Optional[str] = Field(settings.default_user_id, description="用户ID，如果为空则使用默认用户ID")
+    limit: Optional[int] = Field(None, ge=1, le=500, description="每页文档数量，为空时返回全部文档")
+    cursor: Optional[str] = Field(None, description="分页游标，取自上一页返回的next_cursor")
 
 # 删除知识库分组请求模型
 class DocumentGroupDeleteRequest(BaseModel):
@@ -280,6 +283,11 @@ class DocumentDeleteRequest(BaseModel):
     doc_id: str = Field(..., description="文档ID")
     user_id: Optional[str] = Field(settings.default_user_id, description="用户ID，如果为空则使用默认用户ID")
 
+# 批量查询任务状态请求模型
+class TaskStatusBatchRequest(BaseModel):
+    """批量查询任务状态请求模型"""
+    task_ids: List[str] = Field(..., min_length=1, max_length=100, description="任务ID列表，单次最多100个")
+
 # 文本上传请求模型
 # 搜索相关模型
 class SearchRequest(BaseModel):
@@ -331,7 +339,7 @@ class TaskStatus(BaseModel):
     
     class Config:
         json_encoders = {
-            datetime: lambda v: v.strftime('%Y-%m-%d %H:%M:%S')
+            datetime: format_datetime
         }
 
 # 配置模型
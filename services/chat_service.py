@@ -1,38 +1,205 @@
 """聊天服务"""
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional, AsyncGenerator
-import json
+from typing import List, Dict, Any, Optional, AsyncGenerator, Union
 import time
 import uuid
+import orjson
 from openai import AsyncOpenAI
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from core.config import settings
-from core.database import get_db
 from core import active_streams
-from models.database import ChatMessage as DBChatMessage
+from models.database import ChatSession, ChatMessage as DBChatMessage
 from services.search_service import SearchService
 from models.enums import SearchStrategy
 from utils.extract_keyword import extract_keywords, need_web_search
+from core.database import get_async_redis
 logger = logging.getLogger(__name__)
 
+# 流式请求取消标记在Redis中的键前缀与过期时间（秒），多worker/多副本共享
+STREAM_KEY_PREFIX = "stream:"
+STREAM_KEY_TTL = 3600
+# 标记值：未取消 / 已取消
+STREAM_FLAG_ACTIVE = "0"
+STREAM_FLAG_CANCELLED = "1"
+# 跨worker停止请求的发布订阅频道，消息内容为request_id
+STREAM_CANCEL_CHANNEL = "stream:cancel"
+# 取消频道订阅断开后的重连间隔（秒）
+STREAM_LISTENER_RETRY_INTERVAL = 3
+# 等待取消消息的单次超时（秒），避免阻塞读取触发Redis套接字超时
+STREAM_LISTENER_READ_TIMEOUT = 1.0
 
+def truncate_title(text: str, max_length: int) -> str:
+    """截断文本作为会话标题，超出长度时追加省略号"""
+    return text if len(text) <= max_length else f"{text[:max_length]}..."
 
 
+# 大模型客户端（进程内共享，复用与模型服务之间的HTTP连接池）
+_llm_client: Optional[AsyncOpenAI] = None
 
-class ChatService:
-    """聊天服务类 - 集成智能搜索功能"""
-    
-    def __init__(self, db: Optional[Session] = None):
-        self.client = AsyncOpenAI(
+
+def get_llm_client() -> AsyncOpenAI:
+    """获取共享的大模型客户端，首次调用时创建"""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = AsyncOpenAI(
             api_key=settings.SILICONFLOW_API_KEY,
             base_url=settings.SILICONFLOW_BASE_URL
         )
+    return _llm_client
+
+
+async def close_llm_client() -> None:
+    """关闭共享的大模型客户端（应用关闭时调用）"""
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.close()
+        _llm_client = None
+
+
+# 搜索服务实例（进程内共享，避免每次请求重复创建HTTP客户端与向量库连接）
+search_service = SearchService()
+
+
+# 本进程的取消频道订阅任务（首次登记流式请求时启动）
+_cancel_listener: Optional[asyncio.Task] = None
+
+
+def _cancel_local_stream(request_id: str) -> None:
+    """设置本进程内流式请求的取消事件，流不在本进程时忽略"""
+    stream_state = active_streams.get(request_id)
+    if stream_state is not None:
+        stream_state["event"].set()
+
+
+async def _apply_missed_cancellations(redis_client) -> None:
+    """检查本进程所有流的取消标记，补上订阅建立前或断线期间错过的停止请求"""
+    request_ids = list(active_streams)
+    if not request_ids:
+        return
+    flags = await redis_client.mget([f"{STREAM_KEY_PREFIX}{request_id}" for request_id in request_ids])
+    for request_id, flag in zip(request_ids, flags):
+        if flag == STREAM_FLAG_CANCELLED:
+            _cancel_local_stream(request_id)
+
+
+async def _listen_stream_cancellation() -> None:
+    """订阅取消频道，收到其他worker发布的停止请求后设置本进程内对应流的取消事件
+    
+    整个进程共用一个订阅连接，流式请求本身不再轮询Redis。
+    """
+    redis_client = get_async_redis()
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(STREAM_CANCEL_CHANNEL)
+            await _apply_missed_cancellations(redis_client)
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=STREAM_LISTENER_READ_TIMEOUT
+                )
+                if message is not None:
+                    _cancel_local_stream(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"订阅流式请求取消频道失败: {e}")
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+        await asyncio.sleep(STREAM_LISTENER_RETRY_INTERVAL)
+
+
+def _ensure_cancel_listener() -> None:
+    """确保当前事件循环中运行着取消频道订阅任务"""
+    global _cancel_listener
+    if (
+        _cancel_listener is None
+        or _cancel_listener.done()
+        or _cancel_listener.get_loop() is not asyncio.get_running_loop()
+    ):
+        _cancel_listener = asyncio.create_task(_listen_stream_cancellation())
+
+
+async def close_stream_listener() -> None:
+    """停止取消频道订阅任务（应用关闭时调用）"""
+    global _cancel_listener
+    if _cancel_listener is None:
+        return
+    _cancel_listener.cancel()
+    try:
+        await _cancel_listener
+    except asyncio.CancelledError:
+        pass
+    _cancel_listener = None
+
+
+async def register_stream(request_id: str) -> asyncio.Event:
+    """登记流式请求，返回本进程内的取消事件
+    
+    同时在Redis中写入未取消标记，使其他worker上的停止请求能够找到该流；
+    其他worker的停止请求通过取消频道送达，由本进程的订阅任务设置取消事件。
+    """
+    cancel_event = asyncio.Event()
+    active_streams[request_id] = {"event": cancel_event}
+    _ensure_cancel_listener()
+    try:
+        await get_async_redis().set(f"{STREAM_KEY_PREFIX}{request_id}", STREAM_FLAG_ACTIVE, ex=STREAM_KEY_TTL)
+    except Exception as e:
+        logger.warning(f"写入流式请求标记失败 {request_id}: {e}")
+    return cancel_event
+
+
+async def unregister_stream(request_id: str) -> None:
+    """注销流式请求，清理本地状态与Redis标记"""
+    active_streams.pop(request_id, None)
+    try:
+        await get_async_redis().delete(f"{STREAM_KEY_PREFIX}{request_id}")
+    except Exception as e:
+        logger.warning(f"删除流式请求标记失败 {request_id}: {e}")
+
+
+async def stop_stream_generation(request_id: str) -> bool:
+    """停止流式生成并标记为已取消
+    
+    流在本进程内时直接设置取消事件；否则写入Redis标记并发布到取消频道，由负责该流的worker订阅感知。
+    """
+    try:
+        stream_state = active_streams.get(request_id)
+        if stream_state is not None:
+            stream_state["event"].set()
+        else:
+            # 仅当标记存在时覆盖为已取消并保留原过期时间，与发布消息在一次往返中完成；
+            # 标记不存在时发布的消息没有订阅方处理，不影响结果
+            async with get_async_redis().pipeline(transaction=False) as pipe:
+                pipe.set(f"{STREAM_KEY_PREFIX}{request_id}", STREAM_FLAG_CANCELLED, xx=True, keepttl=True)
+                pipe.publish(STREAM_CANCEL_CHANNEL, request_id)
+                updated, _ = await pipe.execute()
+            if not updated:
+                logger.warning(f"尝试停止不存在的流式请求: {request_id}")
+                return False
+        logger.info(f"🛑 已标记流式请求为取消状态: {request_id}")
+        return True
+    except Exception as e:
+        logger.error(f"停止流式生成失败: {e}")
+        return False
+
+
+class ChatService:
+    """聊天服务类 - 集成智能搜索功能"""
+    
+    def __init__(self, db: Optional[AsyncSession] = None):
+        # 大模型客户端与搜索服务均为共享实例，每个请求只需绑定自己的数据库会话
+        self.client = get_llm_client()
         self.db = db  # 数据库会话
         
         # 集成搜索服务
-        # 使用SearchService替代KnowledgeService
-        self.knowledge_service = SearchService()
-        self.search_service = SearchService()
+        # 使用SearchService替代KnowledgeService，知识库与网络搜索共用同一实例
+        self.knowledge_service = search_service
+        self.search_service = search_service
     
     async def intelligent_search(
         self,
@@ -51,44 +218,51 @@ class ChatService:
         decision_reasoning = ""
         
         try:
-            if strategy != SearchStrategy.NONE:
-                logger.info("🔍 执行知识库搜索")
-                knowledge_results = await self.knowledge_service.knowledge_search(
-                    query=query,
-                    group_id=group_id,
-                    top_k=kg_max_results,
-                    similarity_threshold=similarity_threshold,
-                    use_rerank=True,
-                )
-            # 第三步：判断是否需要网络搜索
+            # 第一步：判断是否需要网络搜索（关键词判断，无需等待知识库结果）
+            use_web_search = False
             if strategy == SearchStrategy.WEB_ONLY:
                 decision_reasoning = "仅需网络搜索"
-                query_string = extract_keywords(query)
-                web_results = await self.search_service.web_search(
-                    query=query_string,
-                    max_results=web_max_results
-                )
+                use_web_search = True
             elif strategy == SearchStrategy.KNOWLEDGE_ONLY:
                 decision_reasoning = "仅需知识库搜索"
-                pass
             elif strategy == SearchStrategy.HYBRID:
                 decision_reasoning = "混合检索--知识库+网络搜索"
-                query_string = extract_keywords(query)
-                web_results = await self.search_service.web_search(
-                    query=query_string,
-                    max_results=web_max_results
-                )
+                use_web_search = True
             elif strategy == SearchStrategy.AUTO:
                 if need_web_search(query):
                     decision_reasoning = "根据关键词判断需要网络搜索"
-                    logger.info("🌐 执行网络搜索")
-                    query_string = extract_keywords(query)
-                    web_results = await self.search_service.web_search(
-                        query=query_string,
-                        max_results=web_max_results
-                    )
+                    use_web_search = True
                 else:
                     decision_reasoning = "根据关键词判断不需要网络搜索"
+            
+            # 第二步：知识库搜索与网络搜索相互独立，并发执行
+            search_tasks = {}
+            if strategy != SearchStrategy.NONE:
+                logger.info("🔍 执行知识库搜索")
+                search_tasks['knowledge'] = self.knowledge_service.knowledge_search(
+                    query=query,
+                    group_id=group_id,
+                    top_k=kg_max_results,
+                    similarity_threshold=similarity_threshold,
+                    use_rerank=True,
+                )
+            if use_web_search:
+                logger.info("🌐 执行网络搜索")
+                search_tasks['web'] = self.search_service.web_search(
+                    query=extract_keywords(query),
+                    max_results=web_max_results
+                )
+            
+            results = await asyncio.gather(*search_tasks.values(), return_exceptions=True)
+            for name, result in zip(search_tasks, results):
+                if isinstance(result, Exception):
+                    logger.error(f"{name}搜索失败: {result}")
+                    continue
+                if name == 'knowledge':
+                    knowledge_results = result
+                else:
+                    web_results = result
+            
             logger.info(f"✅ 智能搜索完成: 知识库{len(knowledge_results)}条, 网络{len(web_results)}条")
             logger.info(f"决策依据: {decision_reasoning}")
             return {
@@ -199,12 +373,14 @@ class ChatService:
                     stream=True
                 )
                 
+                # 取消事件在循环外获取一次，循环内只需读取事件状态
+                stream_state = active_streams.get(request_id) if request_id else None
+                cancel_event = stream_state["event"] if stream_state else None
                 async for chunk in response:
                     # 检查是否被取消
-                    if request_id and request_id in active_streams:
-                        if active_streams[request_id].get('cancelled', False):
-                            logger.info(f"🛑 流式响应被用户取消: {request_id}")
-                            break
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.info(f"🛑 流式响应被用户取消: {request_id}")
+                        break
                     
                     if not chunk.choices:
                         continue
@@ -290,9 +466,11 @@ class ChatService:
             # 直接从MySQL数据库获取
             if self.db:
                 logger.info(f"从MySQL查询会话 {session_id} 的聊天历史")
-                messages = self.db.query(DBChatMessage).filter(
-                    DBChatMessage.session_id == session_id
-                ).order_by(DBChatMessage.created_at.asc()).limit(50).all()
+                messages = (await self.db.execute(
+                    select(DBChatMessage.role, DBChatMessage.content, DBChatMessage.thinking_process).where(
+                        DBChatMessage.session_id == session_id
+                    ).order_by(DBChatMessage.created_at.asc()).limit(50)
+                )).all()
                 
                 # 转换为简化格式用于对话上下文
                 simple_history = []
@@ -320,13 +498,18 @@ class ChatService:
         session_id: str,
         user_message: str,
         assistant_message: str,
-        knowledge_sources: Optional[List[Dict[str, Any]]] = None,
-        web_search_results: Optional[List[Dict[str, Any]]] = None,
+        knowledge_sources: Optional[Union[List[Dict[str, Any]], bytes]] = None,
+        web_search_results: Optional[Union[List[Dict[str, Any]], bytes]] = None,
         user_request_id: Optional[str] = None,
         assistant_request_id: Optional[str] = None,
-        thinking_process: Optional[str] = None
-    ):
-        """保存对话历史到MySQL数据库"""
+        thinking_process: Optional[str] = None,
+        session_title: Optional[str] = None
+    ) -> bool:
+        """保存对话历史到MySQL数据库
+        
+        用户消息、助手消息以及可选的会话标题更新在同一事务中提交。
+        knowledge_sources与web_search_results可直接传入已序列化的JSON字节，入库时不再重复编码。
+        """
         try:
             # 生成请求ID
             user_req_id = user_request_id or uuid.uuid4().hex
@@ -335,9 +518,11 @@ class ChatService:
             # 保存到MySQL数据库
             if self.db:
                 # 获取当前会话的最大序号
-                max_sequence = self.db.query(DBChatMessage.sequence_number).filter(
-                    DBChatMessage.session_id == session_id
-                ).order_by(DBChatMessage.sequence_number.desc()).first()
+                max_sequence = (await self.db.execute(
+                    select(DBChatMessage.sequence_number).where(
+                        DBChatMessage.session_id == session_id
+                    ).order_by(DBChatMessage.sequence_number.desc()).limit(1)
+                )).first()
                 
                 next_sequence = (max_sequence[0] + 1) if max_sequence and max_sequence[0] is not None else 1
                 
@@ -358,20 +543,38 @@ class ChatService:
                     role="assistant",
                     content=assistant_message,
                     sequence_number=next_sequence + 1,
-                    knowledge_sources=json.dumps(knowledge_sources, ensure_ascii=False) if knowledge_sources else None,
-                    web_search_results=json.dumps(web_search_results, ensure_ascii=False) if web_search_results else None,
+                    knowledge_sources=self._dump_sources(knowledge_sources),
+                    web_search_results=self._dump_sources(web_search_results),
                     thinking_process=thinking_process
                 )
                 self.db.add(assistant_msg)
-                self.db.commit()
+                
+                if session_title:
+                    await self.db.execute(
+                        update(ChatSession).where(ChatSession.id == session_id).values(title=session_title)
+                    )
+                
+                await self.db.commit()
                 logger.info(f"已保存会话 {session_id} 的对话到MySQL数据库")
+                return True
             else:
                 logger.warning("数据库会话未初始化，无法保存到MySQL")
+                return False
             
         except Exception as e:
             logger.warning(f"保存对话历史失败: {e}")
             if self.db:
-                self.db.rollback()
+                await self.db.rollback()
+            return False
+    
+    @staticmethod
+    def _dump_sources(sources: Optional[Union[List[Dict[str, Any]], bytes]]) -> Optional[str]:
+        """将来源列表转换为入库的JSON文本，已序列化的字节直接解码"""
+        if not sources:
+            return None
+        if isinstance(sources, bytes):
+            return sources.decode()
+        return orjson.dumps(sources).decode()
     
     async def handle_stream_interruption(
         self,
@@ -401,20 +604,6 @@ class ChatService:
         except Exception as e:
             logger.error(f"处理流式中断时保存对话历史失败: {e}")
     
-    async def stop_stream_generation(self, request_id: str) -> bool:
-        """停止流式生成并标记为已取消"""
-        try:
-            if request_id not in active_streams:
-                logger.warning(f"尝试停止不存在的流式请求: {request_id}")
-                return False
-            
-            active_streams[request_id]["cancelled"] = True
-            logger.info(f"🛑 已标记流式请求为取消状态: {request_id}")
-            return True
-        except Exception as e:
-            logger.error(f"停止流式生成失败: {e}")
-            return False
-    
     async def intelligent_chat(
         self,
         message: str,
@@ -443,15 +632,15 @@ class ChatService:
         try:
             if self.db:
                 # 从MySQL删除会话的所有消息
-                self.db.query(DBChatMessage).filter(
-                    DBChatMessage.session_id == session_id
-                ).delete()
-                self.db.commit()
+                await self.db.execute(
+                    delete(DBChatMessage).where(DBChatMessage.session_id == session_id)
+                )
+                await self.db.commit()
                 logger.info(f"已从MySQL删除会话 {session_id} 的所有消息")
         except Exception as e:
             logger.warning(f"清除对话历史失败: {e}")
             if self.db:
-                self.db.rollback()
+                await self.db.rollback()
     
     def get_model_info(self) -> Dict[str, Any]:
         """获取模型信息"""
@@ -495,7 +684,7 @@ class ChatService:
         except Exception as e:
             logger.error(f"快速生成会话标题失败: {e}")
             # 如果生成失败，返回基于用户消息的简单标题
-            return user_message[:12] + "..." if len(user_message) > 12 else user_message
+            return truncate_title(user_message, 12)
     
     async def generate_session_title(self, user_message: str, assistant_message: str) -> str:
         """根据对话内容生成会话标题"""
@@ -531,7 +720,7 @@ class ChatService:
         except Exception as e:
             logger.error(f"生成会话标题失败: {e}")
             # 如果生成失败，返回基于用户消息的简单标题
-            return user_message[:15] + "..." if len(user_message) > 15 else user_message
+            return truncate_title(user_message, 15)
     
     async def test_connection(self) -> bool:
         """测试连接"""
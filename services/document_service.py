@@ -1,5 +1,6 @@
 """文档处理服务"""
 import os
+import mmap
 import logging
 from typing import Dict, Any, List
 import mimetypes
@@ -9,6 +10,21 @@ from core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 不小于该大小的文件通过mmap读取，小文件直接read开销更低
+MMAP_MIN_FILE_SIZE = 128 * 1024
+
+
+def _advise_sequential(fd: int) -> None:
+    """提示内核按顺序预读该文件（仅支持posix_fadvise的平台生效）"""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
+def _decode_text(data, encoding: str, errors: str = 'strict') -> str:
+    """按指定编码解码字节数据，并与文本模式open()一致地统一换行符"""
+    text = str(data, encoding, errors)
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
 class DocumentService:
     """文档处理服务类"""
     
@@ -79,6 +95,7 @@ class DocumentService:
             
             # 准备文件上传 - 使用 files 数组格式
             with open(file_path, 'rb') as f:
+                _advise_sequential(f.fileno())
                 files = {
                     'files': (os.path.basename(file_path), f, 'application/octet-stream')
                 }
@@ -191,32 +208,45 @@ class DocumentService:
             return ""
     
     def _extract_text_directly(self, file_path: str) -> str:
-        """直接读取文件内容，处理不同编码格式"""
+        """直接读取文件内容，处理不同编码格式
+
+        文件只读取一次：大文件通过mmap映射后直接在映射内存上尝试各编码解码，
+        避免每种编码都重新打开并读取整个文件。
+        """
         try:
             # 尝试不同的编码格式
             encodings = ['utf-8', 'gbk', 'gb2312', 'big5', 'latin1']
             
-            for encoding in encodings:
+            with open(file_path, 'rb') as f:
+                _advise_sequential(f.fileno())
+                mm = None
+                if os.fstat(f.fileno()).st_size >= MMAP_MIN_FILE_SIZE:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    data = memoryview(mm)
+                else:
+                    data = f.read()
+                
                 try:
-                    with open(file_path, 'r', encoding=encoding) as f:
-                        content = f.read()
-                        logger.info(f"成功使用 {encoding} 编码读取文件: {file_path}")
-                        return content
-                except UnicodeDecodeError:
-                    continue
-                except Exception as e:
-                    logger.warning(f"使用 {encoding} 编码读取文件失败: {e}")
-                    continue
-            
-            # 如果所有编码都失败，尝试二进制读取并忽略错误
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
+                    for encoding in encodings:
+                        try:
+                            content = _decode_text(data, encoding)
+                            logger.info(f"成功使用 {encoding} 编码读取文件: {file_path}")
+                            return content
+                        except UnicodeDecodeError:
+                            continue
+                        except Exception as e:
+                            logger.warning(f"使用 {encoding} 编码读取文件失败: {e}")
+                            continue
+                    
+                    # 如果所有编码都失败，忽略错误进行解码
+                    content = _decode_text(data, 'utf-8', errors='ignore')
                     logger.warning(f"使用 utf-8 忽略错误模式读取文件: {file_path}")
                     return content
-            except Exception as e:
-                logger.error(f"二进制读取文件也失败: {e}")
-                return ""
+                finally:
+                    if mm is not None:
+                        # 必须先释放memoryview，否则关闭mmap会抛出BufferError
+                        data.release()
+                        mm.close()
                 
         except Exception as e:
             logger.error(f"直接读取文件失败 {file_path}: {e}")
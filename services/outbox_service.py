@@ -0,0 +1,139 @@
+"""任务发件箱服务
+
+业务记录与待投递任务在同一个数据库事务中写入，由后台投递器异步发送到Celery：
+请求路径不再等待broker往返，进程在提交与投递之间崩溃也不会丢失任务。
+投递为至少一次语义：发送成功但标记已投递前崩溃时，同一任务会以相同task_id再次发送，
+任务须自行去重（嵌入任务通过claim_task抢占文档状态，重复消息直接跳过）。
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Any, List, Optional
+
+import orjson
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.database import TaskOutbox, get_shanghai_time
+from services.celery_app import celery_app
+
+logger = logging.getLogger(__name__)
+
+# 已投递记录的保留时长（秒），超时后由投递器清理
+OUTBOX_RETENTION_SECONDS = 24 * 3600
+# 清理已投递记录的间隔（秒）
+OUTBOX_PURGE_INTERVAL = 3600
+
+
+class OutboxService:
+    """任务发件箱服务类"""
+
+    def __init__(self):
+        self.poll_interval = settings.outbox_poll_interval
+        self.batch_size = settings.outbox_batch_size
+        # 新任务提交后唤醒投递器，无需等到下一次轮询
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    def add_task(self, db: AsyncSession, task_name: str, task_id: str, args: List[Any]) -> None:
+        """在当前会话中登记待投递任务，随调用方的事务一起提交"""
+        db.add(TaskOutbox(
+            task_id=task_id,
+            task_name=task_name,
+            payload=orjson.dumps(args).decode()
+        ))
+
+    def notify(self) -> None:
+        """通知投递器有新任务（须在事务提交后调用）"""
+        self._wakeup.set()
+
+    def _send_batch(self, rows: List[TaskOutbox]) -> List[int]:
+        """逐条发送到broker，返回发送成功的记录ID；遇到失败即停止，剩余记录留待下次投递"""
+        sent_ids = []
+        for row in rows:
+            try:
+                celery_app.send_task(row.task_name, args=orjson.loads(row.payload), task_id=row.task_id)
+            except Exception as e:
+                logger.error("投递任务失败 %s: %s", row.task_id, e)
+                break
+            sent_ids.append(row.id)
+        return sent_ids
+
+    async def dispatch_pending(self) -> int:
+        """投递一批待发送任务，返回本批成功投递的数量
+
+        使用 FOR UPDATE SKIP LOCKED 锁定记录，多个应用进程同时运行投递器时不会并发发送同一批记录。
+        """
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(TaskOutbox)
+                .where(TaskOutbox.dispatched_at.is_(None))
+                .order_by(TaskOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = result.scalars().all()
+            if not rows:
+                await db.rollback()
+                return 0
+            # broker发送是同步网络调用，整批放到一个线程中执行
+            sent_ids = await asyncio.to_thread(self._send_batch, rows)
+            if sent_ids:
+                await db.execute(
+                    update(TaskOutbox)
+                    .where(TaskOutbox.id.in_(sent_ids))
+                    .values(dispatched_at=get_shanghai_time())
+                )
+            await db.commit()
+            return len(sent_ids)
+
+    async def purge_dispatched(self) -> None:
+        """清理超过保留时长的已投递记录"""
+        cutoff = get_shanghai_time() - timedelta(seconds=OUTBOX_RETENTION_SECONDS)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(TaskOutbox).where(TaskOutbox.dispatched_at < cutoff))
+            await db.commit()
+
+    async def run(self) -> None:
+        """投递循环：被唤醒或轮询超时后投递待发送任务"""
+        while True:
+            sent = 0
+            try:
+                sent = await self.dispatch_pending()
+                if time.monotonic() - self._last_purge >= OUTBOX_PURGE_INTERVAL:
+                    self._last_purge = time.monotonic()
+                    await self.purge_dispatched()
+            except Exception as e:
+                logger.error("任务发件箱投递失败: %s", e)
+            if sent >= self.batch_size:
+                # 本批已满，可能还有积压，立即继续
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        """在当前事件循环中启动投递器"""
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """停止投递器，未投递的任务保留在发件箱中，下次启动后继续投递"""
+        if self._runner is None:
+            return
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        self._runner = None
+
+
+# 全局发件箱服务实例
+outbox_service = OutboxService()
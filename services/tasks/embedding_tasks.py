@@ -4,13 +4,13 @@ from contextlib import contextmanager
 from typing import Dict, Any, List
 import os
 import json
-import asyncio
 import uuid
 import requests
 from urllib.parse import urlparse
 from datetime import datetime, timezone, timedelta
 import mimetypes
 import logging
+from sqlalchemy import and_, or_
 from models.enums import DocType
 from core.config import settings
 from core.database import get_db
@@ -20,10 +20,14 @@ from services.document_service import DocumentService
 from services.embedding_service import EmbeddingService
 from services.vector_service import VectorService
 from services.celery_app import celery_app
+from utils.time_utils import format_datetime
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 可由update_task_status更新的任务表字段
+TASK_STATUS_COLUMNS = frozenset(KbDocument.__table__.columns.keys())
+
 # 初始化服务
 document_service = DocumentService()
 embedding_service = EmbeddingService()
@@ -45,25 +49,47 @@ def get_db_session():
 
 
 def update_task_status(doc_id: str, **kwargs):
-    """更新任务状态的辅助函数"""
+    """更新任务状态的辅助函数
+    
+    直接执行一条UPDATE语句并提交，不先查询、不构建ORM对象。
+    """
     if not doc_id:
         raise ValueError("doc_id不能为空")
     
+    values = {key: value for key, value in kwargs.items() if key in TASK_STATUS_COLUMNS}
+    if not values:
+        return
     try:
         with get_db_session() as db:
-            task_record = db.query(KbDocument).filter(
+            db.query(KbDocument).filter(
                 KbDocument.doc_id == doc_id
-            ).first()
-            if task_record:
-                for key, value in kwargs.items():
-                    if hasattr(task_record, key):
-                        setattr(task_record, key, value)
-                db.commit()
-                logger.debug(f"任务状态更新成功: {kwargs}")
+            ).update(values, synchronize_session=False)
+            db.commit()
+            logger.debug(f"任务状态更新成功: {kwargs}")
     except Exception as e:
         logger.error(f"更新任务状态失败: {e}")
 
 
+def claim_task(doc_id: str) -> bool:
+    """将任务由待处理标记为处理中，返回是否抢占成功
+    
+    发件箱按至少一次语义投递，同一任务可能收到重复消息，只有抢占成功的消息继续处理。
+    处理中超过硬时限的任务视为worker异常退出，允许重新投递的消息接手。
+    """
+    now = datetime.now(timezone(timedelta(hours=8)))
+    stale_before = now - timedelta(seconds=celery_app.conf.task_time_limit)
+    with get_db_session() as db:
+        claimed = db.query(KbDocument).filter(
+            KbDocument.doc_id == doc_id,
+            or_(
+                KbDocument.status == TaskStatus.PENDING,
+                and_(KbDocument.status == TaskStatus.PROCESSING, KbDocument.started_at < stale_before)
+            )
+        ).update({"status": TaskStatus.PROCESSING, "started_at": now}, synchronize_session=False)
+        db.commit()
+    return claimed > 0
+
+
 @celery_app.task(bind=True)
 def process_and_embed_document_task(self, request_data: dict) -> Dict[str, Any]:
     """
@@ -78,13 +104,11 @@ def process_and_embed_document_task(self, request_data: dict) -> Dict[str, Any]:
     # 将字典转换为KbDocumentRequest对象
     request = KbDocumentRequest(**request_data)
     try:
+        # 更新任务状态为处理中；任务已在处理或已结束时为重复投递，直接跳过
+        if not claim_task(request.doc_id):
+            logger.info(f"任务已处理或正在处理，跳过重复消息: {request.doc_id}")
+            return {"status": "skipped", "doc_id": request.doc_id}
         logger.info(f"开始处理文档: {request.file_path}, 类型: {request.doc_type}")
-        # 更新任务状态为处理中
-        update_task_status(
-            request.doc_id,
-            status=TaskStatus.PROCESSING,
-            started_at=datetime.now(timezone(timedelta(hours=8)))
-        )
         # 统一初始化，避免在 POST 类型下未定义
         is_url = False
         temp_file_path = None
@@ -170,6 +194,10 @@ def process_and_embed_document_task(self, request_data: dict) -> Dict[str, Any]:
         logger.info(f"开始处理 {len(chunks)} 个分块，目标集合: {collection_name}")
         # 顺序处理每个分块（无需批处理，Celery 已并发）
         all_vectors = []
+        last_progress_step = None
+        # 同一文档的分块共用一个时间戳，避免逐块获取当前时间并格式化
+        vector_timestamp = format_datetime(datetime.now(timezone(timedelta(hours=8))))
+        base_name = request.doc_name or os.path.basename(actual_file_path)
         for idx, chunk in enumerate(chunks):
             try:
                 # 记录分块基本信息，避免日志过长仅打印长度
@@ -178,7 +206,6 @@ def process_and_embed_document_task(self, request_data: dict) -> Dict[str, Any]:
                 embedding = embedding_service.generate_embedding_sync(chunk)
                 if embedding:
                     logger.debug(f"分块 {idx+1} 嵌入维度={len(embedding)}")
-                    base_name = request.doc_name or os.path.basename(actual_file_path)
                     vector_id = uuid.uuid4().hex
                     vector_data = {
                         "collection_name": collection_name,
@@ -186,8 +213,8 @@ def process_and_embed_document_task(self, request_data: dict) -> Dict[str, Any]:
                         "doc_id": request.doc_id or "default",
                         "doc_name": base_name,
                         "source_path": actual_file_path or (request.file_path or 'unknown'),
-                        "create_at": datetime.now(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S'),
-                        "update_at": datetime.now(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S'),
+                        "create_at": vector_timestamp,
+                        "update_at": vector_timestamp,
                         "chunk_content": chunk,
                         "vector": embedding,
                         "doc_type": request.doc_type,
@@ -205,12 +232,16 @@ def process_and_embed_document_task(self, request_data: dict) -> Dict[str, Any]:
                 # 打印堆栈，便于定位失败原因
                 logger.exception(f"分块 {idx+1} 处理异常：{chunk_error}")
             finally:
-                # 10% -> 90% 线性进度
-                update_task_status(
-                    request.doc_id,
-                    processed_chunks=processed_count,
-                    progress=10.0 + ((idx + 1) / len(chunks)) * 80.0
-                )
+                # 10% -> 90% 线性进度；仅在整数百分比变化或最后一块时写库，避免每个分块都提交一次事务
+                progress = 10.0 + ((idx + 1) / len(chunks)) * 80.0
+                progress_step = int(progress)
+                if progress_step != last_progress_step or idx + 1 == len(chunks):
+                    last_progress_step = progress_step
+                    update_task_status(
+                        request.doc_id,
+                        processed_chunks=processed_count,
+                        progress=progress
+                    )
         # 一次性批量写入向量库，避免逐条插入触发重复删除同一 doc_id 导致数据丢失
         if all_vectors:
             try:
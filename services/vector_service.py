@@ -1,14 +1,14 @@
 """向量数据库服务"""
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-import uuid
+from typing import List, Dict, Any, Optional
 import json
 
 # Milvus相关导入（如果没有安装会在运行时提示）
 try:
     from pymilvus import (
         connections, Collection, CollectionSchema, FieldSchema, DataType,
-        utility, MilvusException
+        utility
     )
     MILVUS_AVAILABLE = True
 except ImportError:
@@ -33,41 +33,48 @@ class VectorService:
         
         self._connected = False
         self._collections = {}
+        # 防止并发请求重复建立连接
+        self._connect_lock = asyncio.Lock()
     
     async def connect(self) -> bool:
-        """连接到Milvus"""
+        """连接到Milvus（已连接时直接返回）"""
         if not MILVUS_AVAILABLE:
             logger.error("Milvus客户端未安装")
             return False
         
-        try:
-            # 连接配置
-            connect_params = {
-                "host": self.host,
-                "port": self.port
-            }
-            
-            if self.user and self.password:
-                connect_params.update({
-                    "user": self.user,
-                    "password": self.password
-                })
-            
-            # 建立连接
-            connections.connect(
-                alias="default",
-                **connect_params
-            )
-            
-            self._connected = True
-            logger.info(f"Milvus连接成功: {self.host}:{self.port}")
-            
-            return True
+        async with self._connect_lock:
+            if self._connected:
+                return True
             
-        except Exception as e:
-            logger.error(f"Milvus连接失败: {e}")
-            self._connected = False
-            return False
+            try:
+                # 连接配置
+                connect_params = {
+                    "host": self.host,
+                    "port": self.port
+                }
+                
+                if self.user and self.password:
+                    connect_params.update({
+                        "user": self.user,
+                        "password": self.password
+                    })
+                
+                # 建立连接（pymilvus为同步客户端，放到线程中执行避免阻塞事件循环）
+                await asyncio.to_thread(
+                    connections.connect,
+                    alias="default",
+                    **connect_params
+                )
+                
+                self._connected = True
+                logger.info(f"Milvus连接成功: {self.host}:{self.port}")
+                
+                return True
+                
+            except Exception as e:
+                logger.error(f"Milvus连接失败: {e}")
+                self._connected = False
+                return False
     
     async def create_collection(
         self,
@@ -405,6 +412,38 @@ class VectorService:
             collection_name, query_embedding, top_k, similarity_threshold, user_id
         )
     
+    def _search_collection(
+        self,
+        collection_name: str,
+        query_embedding: List[float],
+        search_params: Dict[str, Any],
+        top_k: int,
+        filter_expr: Optional[str],
+        output_fields: List[str],
+    ):
+        """在指定集合中执行向量搜索（同步，供线程池调用）
+        
+        集合不存在时返回None。
+        """
+        # 获取集合
+        if collection_name not in self._collections:
+            if not utility.has_collection(collection_name):
+                logger.warning(f"集合不存在: {collection_name}")
+                return None
+            collection = Collection(collection_name)
+            collection.load()
+            self._collections[collection_name] = collection
+        else:
+            collection = self._collections[collection_name]
+        return collection.search(
+            data=[query_embedding],
+            anns_field="vector",  # 修正字段名
+            param=search_params,
+            limit=top_k,
+            expr=filter_expr,  # 添加用户和分组过滤
+            output_fields=output_fields
+        )
+    
     async def search_vectors_async(
         self,
         collection_name: str,
@@ -422,16 +461,6 @@ class VectorService:
             logger.error("Milvus未连接")
             return []
         try:
-            # 获取集合
-            if collection_name not in self._collections:
-                if not utility.has_collection(collection_name):
-                    logger.warning(f"集合不存在: {collection_name}")
-                    return []
-                collection = Collection(collection_name)
-                collection.load()
-                self._collections[collection_name] = collection
-            else:
-                collection = self._collections[collection_name]
             # 搜索参数
             search_params = {
                 "metric_type": "IP",
@@ -446,15 +475,18 @@ class VectorService:
             
             filter_expr = " and ".join(filter_conditions) if filter_conditions else None
             
-            # 执行搜索
-            results = collection.search(
-                data=[query_embedding],
-                anns_field="vector",  # 修正字段名
-                param=search_params,
-                limit=top_k,
-                expr=filter_expr,  # 添加用户和分组过滤
-                output_fields=["doc_id", "doc_name", "source_path", "create_at", "update_at", "chunk_content", "doc_type", "user_id", "group_id"]
+            # 执行搜索（pymilvus为同步调用，放到线程中执行避免阻塞事件循环）
+            results = await asyncio.to_thread(
+                self._search_collection,
+                collection_name,
+                query_embedding,
+                search_params,
+                top_k,
+                filter_expr,
+                ["doc_id", "doc_name", "source_path", "create_at", "update_at", "chunk_content", "doc_type", "user_id", "group_id"]
             )
+            if results is None:
+                return []
             # 处理结果
             search_results = []
             for hits in results:
@@ -553,8 +585,8 @@ class VectorService:
             else:
                 collection = self._collections[collection_name]
             
-            # 构建删除表达式
-            expr = f'doc_id == "{doc_id}"'
+            # 构建删除表达式（doc_id按JSON字符串转义，避免引号等字符破坏过滤表达式）
+            expr = f'doc_id == {json.dumps(doc_id)}'
             
             # 执行删除
             collection.delete(expr)
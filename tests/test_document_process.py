@@ -0,0 +1,78 @@
+"""文档处理任务提交接口测试"""
+import asyncio
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+aiosqlite = pytest.importorskip("aiosqlite")
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from core.database import get_async_db
+from main import app
+from models.database import Base, KbDocument, TaskOutbox
+from models.enums import DocType, TaskStatus
+
+FILE_PROCESS_URL = "/api/v1/kb/tasks/file_process"
+
+
+@pytest.fixture
+def session_factory():
+    """使用内存SQLite替代MySQL，请求与断言共享同一个连接"""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create_tables())
+    factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    async def override_db():
+        async with factory() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_db
+    yield factory
+    app.dependency_overrides.pop(get_async_db, None)
+    asyncio.run(engine.dispose())
+
+
+def _fetch_all(factory, model):
+    async def fetch():
+        async with factory() as db:
+            return (await db.execute(select(model))).scalars().all()
+
+    return asyncio.run(fetch())
+
+
+def test_submit_file_url_creates_task(session_factory):
+    client = TestClient(app)
+    file_url = "https://example.com/docs/manual.pdf"
+    response = client.post(FILE_PROCESS_URL, data={"file_url": file_url, "user_id_form": "u1", "group_id": "g1"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"] is True
+    assert body["data"]["filename"] == "manual.pdf"
+
+    [document] = _fetch_all(session_factory, KbDocument)
+    assert document.doc_type == DocType.FILE
+    assert document.doc_path == file_url
+    assert document.status == TaskStatus.PENDING
+
+    [outbox_row] = _fetch_all(session_factory, TaskOutbox)
+    [task_args] = orjson.loads(outbox_row.payload)
+    assert task_args["file_path"] == file_url
+    assert task_args["doc_id"] == document.doc_id
+
+
+@pytest.mark.parametrize("file_url", ["ftp://example.com/a.pdf", "not-a-url", "file:///etc/passwd"])
+def test_submit_invalid_file_url_returns_400(session_factory, file_url):
+    client = TestClient(app)
+    response = client.post(FILE_PROCESS_URL, data={"file_url": file_url})
+
+    assert response.status_code == 400
+    assert _fetch_all(session_factory, KbDocument) == []
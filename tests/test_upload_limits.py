@@ -0,0 +1,62 @@
+"""上传文件大小限制测试"""
+import tempfile
+
+import anyio
+import pytest
+from fastapi import HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+import api.knowledge_base as kb
+from core.config import settings
+from core.database import get_async_db
+from main import app
+
+
+async def _no_db():
+    """超限请求在访问数据库前即被拒绝，不需要真实会话"""
+    yield None
+
+
+def test_max_file_bytes_uses_megabytes():
+    assert kb.MAX_FILE_BYTES == settings.max_file_size * 1024 * 1024
+    assert kb.MAX_FILE_BYTES < 1024 * 1024 * 1024
+
+
+def test_upload_over_limit_returns_413(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+    app.dependency_overrides[get_async_db] = _no_db
+    try:
+        client = TestClient(app)
+        response = client.post(
+            "/api/v1/kb/tasks/file_process",
+            files={"file": ("big.txt", b"a" * (kb.MAX_FILE_BYTES + 1), "text/plain")},
+        )
+    finally:
+        app.dependency_overrides.pop(get_async_db, None)
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def _upload(content: bytes, spool_max_size: int) -> UploadFile:
+    """构造未声明大小的上传文件，spool_max_size为0时内容始终留在内存，否则超出后溢写到磁盘"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+    spooled.write(content)
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename="big.txt")
+
+
+@pytest.mark.parametrize("spool_max_size", [0, 1])
+def test_save_upload_over_limit_removes_partial_file(tmp_path, spool_max_size):
+    file_path = tmp_path / "big.txt"
+    upload = _upload(b"a" * (3 * kb.UPLOAD_CHUNK_SIZE + 1), spool_max_size)
+    with pytest.raises(HTTPException) as exc_info:
+        anyio.run(kb._save_upload_file, upload, str(file_path), 2 * kb.UPLOAD_CHUNK_SIZE)
+    assert exc_info.value.status_code == 413
+    assert not file_path.exists()
+
+
+def test_save_upload_within_limit(tmp_path):
+    file_path = tmp_path / "small.txt"
+    upload = _upload(b"hello", 0)
+    assert anyio.run(kb._save_upload_file, upload, str(file_path), kb.MAX_FILE_BYTES) == 5
+    assert file_path.read_bytes() == b"hello"
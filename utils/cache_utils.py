@@ -0,0 +1,88 @@
+"""Redis缓存工具函数"""
+import logging
+from typing import Any, Optional
+
+import orjson
+
+from core.database import get_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+
+def cache_get_json(key: str) -> Optional[Any]:
+    """读取JSON缓存
+
+    Redis不可用或缓存未命中时返回None，调用方应回退到数据库查询。
+
+    Args:
+        key: 缓存键
+
+    Returns:
+        Any: 反序列化后的缓存值，未命中返回None
+    """
+    try:
+        value = get_redis().get(key)
+        return orjson.loads(value) if value is not None else None
+    except Exception as e:
+        logger.warning(f"读取缓存失败 {key}: {e}")
+        return None
+
+
+def cache_set_json(key: str, value: Any, ttl: int, option: Optional[int] = None) -> bool:
+    """写入JSON缓存
+
+    Args:
+        key: 缓存键
+        value: 可被orjson序列化的值
+        ttl: 过期时间（秒）
+        option: orjson序列化选项（如orjson.OPT_SERIALIZE_NUMPY）
+
+    Returns:
+        bool: 写入成功返回True，失败返回False
+    """
+    try:
+        get_redis().setex(key, ttl, orjson.dumps(value, option=option))
+        return True
+    except Exception as e:
+        logger.warning(f"写入缓存失败 {key}: {e}")
+        return False
+
+
+def cache_delete(*keys: str) -> None:
+    """删除缓存（用于数据变更后的失效处理）"""
+    if not keys:
+        return
+    try:
+        get_redis().delete(*keys)
+    except Exception as e:
+        logger.warning(f"删除缓存失败 {keys}: {e}")
+
+
+async def cache_get_json_async(key: str) -> Optional[Any]:
+    """读取JSON缓存（异步版本，供异步路由使用，不阻塞事件循环）"""
+    try:
+        value = await get_async_redis().get(key)
+        return orjson.loads(value) if value is not None else None
+    except Exception as e:
+        logger.warning(f"读取缓存失败 {key}: {e}")
+        return None
+
+
+async def cache_set_json_async(key: str, value: Any, ttl: int, option: Optional[int] = None) -> bool:
+    """写入JSON缓存（异步版本），参数与返回值同cache_set_json"""
+    try:
+        await get_async_redis().setex(key, ttl, orjson.dumps(value, option=option))
+        return True
+    except Exception as e:
+        logger.warning(f"写入缓存失败 {key}: {e}")
+        return False
+
+
+async def cache_delete_async(*keys: str) -> None:
+    """删除缓存（异步版本）"""
+    if not keys:
+        return
+    try:
+        await get_async_redis().delete(*keys)
+    except Exception as e:
+        logger.warning(f"删除缓存失败 {keys}: {e}")
@@ -0,0 +1,20 @@
+"""时间格式化工具函数"""
+from datetime import datetime
+from typing import Optional
+
+
+def format_datetime(dt: Optional[datetime]) -> Optional[str]:
+    """将时间格式化为 YYYY-MM-DD HH:MM:SS
+
+    使用isoformat代替strftime，避免经由libc的格式化开销与区域设置依赖；
+    截取前19位以去掉带时区时间的UTC偏移，输出与strftime('%Y-%m-%d %H:%M:%S')一致。
+
+    Args:
+        dt: 待格式化的时间，None时原样返回
+
+    Returns:
+        Optional[str]: 格式化后的字符串，dt为None时返回None
+    """
+    if dt is None:
+        return None
+    return dt.isoformat(sep=' ', timespec='seconds')[:19]